@@ -1,12 +1,11 @@
-import gc
-import os
-import time
-import csv
 import logging
 
 from stroboscope.algorithms.confine import CONFINE_OPT
 from .parse import (init_parser, parse_commandline, parse_paths, parse_topo,
-                    build_graphs, build_paths)
+                    build_graphs, build_paths, apply_workload)
+from .runner import results_writer, run_sweep
+from .topologies.features import FIELDS as FEATURE_FIELDS
+from . import timing
 
 
 LOG = logging.getLogger(__name__)
@@ -14,7 +13,7 @@ LOG.setLevel(logging.INFO)
 
 
 FIELDS = ['function', 'time', 'input_len', 'output_len', 'egress_selection',
-          'path_selection', 'graph', 'egress_cnt', 'perturb']
+          'path_selection', 'graph', 'egress_cnt', 'perturb'] + FEATURE_FIELDS
 
 
 def parse_args():
@@ -25,49 +24,47 @@ def parse_args():
         'possibilities of these arguments across groups.')
     parse_paths(parser)
     parse_topo(parser)
+    # The algorithms are quick, time them repeatedly
+    parser.set_defaults(**timing.REPEATED)
     args = parse_commandline(parser)
+    apply_workload(args)
     return args, build_graphs(args)
 
 
-def test(runid, f, g, path, writer, args):
+def test(f, g, path, args):
     try:
-        t = -time.clock()
-        sampling = f(g, path)
-        t += time.clock()
+        sampling, measures = timing.measure(f, g, path)
         outlen = len(sampling)
     except Exception as e:
         LOG.exception(e)
-        t = outlen = -1
-    res = {'function': f.__name__, 'time': t, 'input_len': len(path),
+        measures = {'time': -1}
+        outlen = -1
+    res = {'function': f.__name__, 'input_len': len(path),
            'output_len': outlen, 'graph': g.name,
            'egress_selection': args.egress_selection,
            'path_selection': args.path_selection,
            'perturb': args.path_perturb,
            'egress_cnt': len(g.egresses)}
-    LOG.info("Run %d: %s", runid, res)
-    writer.writerow(res)
+    res.update(g.features.summary())
+    res.update(measures)
+    return res
+
+
+def run(g, args, repeat):
+    """Benchmark every function on the paths of a graph"""
+    pcount = 0
+    for path in build_paths(g, args, repeat):
+        for f in CONFINE_OPT:
+            yield test(f, g, path, args)
+        pcount += 1
+        if pcount > args.max_path:
+            break
 
 
 def main():
     args, graphs = parse_args()
-    existed = os.path.exists(args.out)
-    with open(args.out, 'a') as outfile:
-        writer = csv.DictWriter(outfile, FIELDS)
-        if not existed:
-            writer.writeheader()
-        runid = 0
-        for g in graphs:
-            for _ in xrange(args.repeat):
-                pcount = 0
-                for path in build_paths(g, args):
-                    for f in CONFINE_OPT:
-                        test(runid, f, g, path, writer, args)
-                        runid += 1
-                    pcount += 1
-                    if pcount > args.max_path:
-                        break
-            gc.collect()
-            gc.collect()
+    with results_writer(args.out, FIELDS + timing.fields()) as writer:
+        run_sweep(graphs, run, writer, args)
 
 
 if __name__ == '__main__':
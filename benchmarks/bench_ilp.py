@@ -1,13 +1,17 @@
-import os
-import csv
-import time
+import collections
+import copy
+import itertools
 import logging
 
 import stroboscope.algorithms.schedule as ilp
 
-from .utils import mean_stdev
+from . import sandbox, timing
+from .schedule_analysis import Occupancy
 from .parse import (init_parser, parse_budget, parse_queries,
-                    parse_commandline, build_queries, build_budget)
+                    parse_commandline, build_queries, build_budget,
+                    apply_queries, query_features)
+from .runner import results_writer, run_sweep
+from .topologies.features import FIELDS as FEATURE_FIELDS
 
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.INFO)
@@ -16,74 +20,149 @@ LOG.setLevel(logging.INFO)
 FIELDS = ['time', 'budget_avg', 'budget_stdev', 'query_count', 'active',
           'passive', 'slots_avg', 'slots_stdev', 'gap', 'total_alloc',
           'slots', 'usage_avg', 'usage_stdev', 'function',
-          'min_alloc_count']
+          'min_alloc_count', 'timeslots', 'using', 'outcome',
+          'max_alloc_count', 'usage_max', 'jain', 'lp_bound', 'lp_gap',
+          'graph', 'alloc_avg', 'alloc_stdev', 'unscheduled'] + FEATURE_FIELDS
+# The parameters swept by the benchmark, as (argument, column) pairs
+SWEPT = [('query_count', 'query_count'), ('active_ratio', 'active'),
+         ('passive_ratio', 'passive'), ('timeslots', 'timeslots'),
+         ('using', 'using'), ('query_graph', 'graph')]
+
+
+class SweepPoint(collections.namedtuple(
+        'SweepPoint', [arg for arg, _ in SWEPT])):
+    """A combination of the swept parameters"""
+
+    @property
+    def name(self):
+        return '-'.join('%s=%s' % (col, v)
+                        for (_, col), v in itertools.izip(SWEPT, self)
+                        if v is not None)
+
+    def build(self):
+        return self
+
+    def apply(self, args):
+        """:return: a copy of the arguments set to this point"""
+        args = copy.copy(args)
+        for arg, v in itertools.izip(self._fields, self):
+            setattr(args, arg, v)
+        return args
 
 
 def parse_args():
     parser = init_parser(
         description='ILP benchmarking suite',
         epilog='This benchmark is designed to run a single instance of the'
-        'ILP at a time, in order to mimize the side-effects of the gc, ...',
+        'ILP at a time, in order to mimize the side-effects of the gc, ... '
+        'It is run for every combination of the values given to the query '
+        'counts, timeslots and budget ratio, each in its own process.',
         default_timeout=240)
-    parse_budget(parser)
-    parse_queries(parser)
+    parse_budget(parser, sweep=True)
+    parse_queries(parser, sweep=True)
     parser.add_argument('--restrict', help='restrict to the chosen ILP algo',
                         choices=ilp.FUNCS.keys(), default=ilp.FUNCS.keys(),
                         nargs='*')
+    isolation = parser.add_argument_group('Solver isolation')
+    isolation.add_argument('--isolate', help='Run every solver in a forked '
+                           'child process, with hard limits, and record its '
+                           'outcome (one of %s)' % ', '.join(sandbox.OUTCOMES),
+                           action='store_true', default=False)
+    isolation.add_argument('--kill-after', help='The wall-clock time (in '
+                           'seconds) after which an isolated solver is '
+                           'killed, twice the maximal execution time by '
+                           'default', type=float, default=None)
+    isolation.add_argument('--cpu-limit', help='The CPU time limit (in '
+                           'seconds) of an isolated solver', type=float,
+                           default=None)
+    isolation.add_argument('--memory-limit', help='The address space limit '
+                           '(in MB) of an isolated solver', type=int,
+                           default=None)
     args = parse_commandline(parser)
+    apply_queries(args)
     return (args, args.restrict)
 
 
-def test(f, queries, budget, writer, args):
-    try:
-        LOG.info('Trying solver: %s', f)
-        runtime = -time.clock()
-        schedule = ilp.balance_and_schedule(queries, budget, f)
-        runtime += time.clock()
-        if not schedule:
-            LOG.error('Empty schedule and no exception thrown ?')
-            return
-        _sched = {}
-        for slot in schedule:
-            for q in slot:
-                try:
-                    _sched[q] += 1
-                except KeyError:
-                    _sched[q] = 1
-        avg_slots, stdev_slots = mean_stdev(_sched.values())
-        res = {'time': runtime,
-               'total_alloc': sum(len(slot) for slot in schedule),
-               'min_alloc_count': min(_sched.itervalues()),
-               'budget_avg': args.demand_ratio_avg,
-               'budget_stdev': args.demand_ratio_stdev,
-               'query_count': len(queries),
-               'active': args.active_ratio,
-               'passive': args.passive_ratio,
-               'slots_avg': avg_slots,
-               'slots_stdev': stdev_slots,
-               'gap': args.gap, 'slots': len(schedule),
-               'function': f}
-        LOG.info(res)
-        writer.writerow(res)
-    except ilp.NoSchedule as e:
-        LOG.error("%s could not compute a schedule for %s: %s", f, args, e)
+def solve(f, queries, budget):
+    """Schedule the queries with the given ILP algorithm
+    :return: the result columns describing the schedule, or None if it is
+             empty
+    :raise: ilp.NoSchedule"""
+    schedule, measures = timing.measure(ilp.balance_and_schedule,
+                                        queries, budget, f)
+    if not schedule:
+        LOG.error('Empty schedule and no exception thrown ?')
+        return None
+    res = Occupancy(schedule, queries).summary(budget)
+    res.update(measures)
+    return res
+
+
+def test(f, queries, budget, args):
+    """Schedule the queries with the given ILP algorithm, in a child process
+    if args.isolate is set
+    :return: the result row, or None if there is no schedule"""
+    LOG.info('Trying solver: %s', f)
+    if args.isolate:
+        start = timing.perf_counter()
+        outcome, res = sandbox.call(
+            solve, (f, queries, budget),
+            timeout=args.kill_after or 2 * args.max_exec_time,
+            cpu=args.cpu_limit, memory=args.memory_limit)
+        elapsed = timing.perf_counter() - start
+        if (outcome == sandbox.ERROR and res is not None and
+                res.is_a(ilp.NoSchedule)):
+            outcome, res = sandbox.OK, None
+            LOG.error("%s could not compute a schedule for %s", f, args)
+        elif outcome != sandbox.OK:
+            LOG.error('%s failed (%s) for %s: %s', f, outcome, args, res)
+            res = {'time': elapsed}
+    else:
+        outcome = sandbox.OK
+        try:
+            res = solve(f, queries, budget)
+        except ilp.NoSchedule as e:
+            LOG.error("%s could not compute a schedule for %s: %s", f, args,
+                      e)
+            res = None
+    if not res:
+        return None
+    res.update({'budget_avg': args.demand_ratio_avg,
+                'budget_stdev': args.demand_ratio_stdev,
+                'query_count': len(queries),
+                'active': args.active_ratio,
+                'passive': args.passive_ratio,
+                'gap': args.gap,
+                'timeslots': args.timeslots, 'using': args.using,
+                'function': f, 'outcome': outcome,
+                'graph': args.query_graph})
+    res.update(query_features(args))
+    return res
+
+
+def run(point, args, repeat):
+    """Benchmark every ILP algorithm on a query set built for a sweep point"""
+    args = point.apply(args)
+    budget = build_budget(args)
+    queries = build_queries(budget, args, repeat)
+    if queries is None:
+        return
+    LOG.info("Built %d queries with %s and %d slots", len(queries),
+             str(budget).replace('\n', '').replace('   ', ''),
+             budget.max_slots)
+    for f in args.restrict:
+        res = test(f, queries, budget, args)
+        if res:
+            yield res
 
 
 def main():
-    args, funcs = parse_args()
-    existed = os.path.exists(args.out)
-    with open(args.out, 'a') as outfile:
-        writer = csv.DictWriter(outfile, FIELDS)
-        if not existed:
-            writer.writeheader()
-        budget = build_budget(args)
-        queries = build_queries(budget, args)
-        LOG.info("Built %d queries with %s and %d slots", len(queries),
-                 str(budget).replace('\n', '').replace('   ', ''),
-                 budget.max_slots)
-        for _ in xrange(args.repeat):
-            for f in funcs:
-                test(f, queries, budget, writer, args)
+    args, _ = parse_args()
+    points = [SweepPoint(*values) for values in
+              itertools.product(*(getattr(args, arg) for arg, _ in SWEPT))]
+    LOG.info('Sweeping over %d points', len(points))
+    with results_writer(args.out, FIELDS + timing.fields()) as writer:
+        run_sweep(points, run, writer, args, isolate=True)
 
 
 if __name__ == '__main__':
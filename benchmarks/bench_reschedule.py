@@ -0,0 +1,251 @@
+"""
+Incremental rescheduling benchmark.
+
+A running query set is updated by a stream of events, each adding, removing
+or changing the cost of a few queries. After every event, the queries are
+rescheduled either from scratch by the ILP algorithms (cold), or by
+repairing the previous schedule (warm): the removed queries are dropped,
+the slots exceeding the budget shed their most expensive queries, and the
+unscheduled queries are placed in the slots with the most budget left. A
+warm start that cannot place every query falls back to a cold solve.
+
+Every rescheduling reports the time it took, split between the repair of
+a warm start, which stops at its first feasible schedule, and the full
+solve of the ILP algorithm. The solvers do not report their incumbents, so
+the time to the first feasible schedule of a cold solve is not known, and
+only bounded by its full solve time. Every rescheduling also reports the
+number of slots it perturbs with respect to the previous schedule.
+"""
+import copy
+import itertools
+import logging
+import random
+
+import stroboscope.algorithms.schedule as ilp
+
+from . import timing
+from .bench_ilp import SWEPT, SweepPoint
+from .parse import (init_parser, parse_budget, parse_queries,
+                    parse_commandline, build_queries, build_budget,
+                    apply_queries)
+from .runner import results_writer, run_sweep
+from .schedule_analysis import FIELDS as SCHEDULE_FIELDS
+from .schedule_analysis import Occupancy, perturbed_slots
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.INFO)
+
+
+FIELDS = ['event', 'kind', 'changed', 'mode', 'function', 'time',
+          'repair_time', 'solve_time', 'fallback', 'perturbed',
+          'query_count', 'timeslots', 'using', 'active', 'passive',
+          'graph'] + SCHEDULE_FIELDS
+EVENTS = ['add', 'remove', 'cost']
+MODES = ['cold', 'warm']
+
+
+def parse_args():
+    parser = init_parser(
+        description='Incremental rescheduling benchmark',
+        epilog='The events are applied to the query set of every '
+        'combination of the values given to the query counts, timeslots '
+        'and budget ratio, each in its own process.',
+        default_timeout=240)
+    parse_budget(parser, sweep=True)
+    parse_queries(parser, sweep=True)
+    parser.add_argument('--restrict', help='restrict to the chosen ILP algo',
+                        choices=ilp.FUNCS.keys(), default=ilp.FUNCS.keys(),
+                        nargs='*')
+    events = parser.add_argument_group('Query set events')
+    events.add_argument('--events', help='The number of events applied to '
+                        'the query set', type=int, default=20)
+    events.add_argument('--batch', help='The number of queries changed by '
+                        'an event', type=int, default=1)
+    events.add_argument('--event-weights', help='The relative frequencies '
+                        'of the %s events' % ', '.join(EVENTS), type=float,
+                        nargs=len(EVENTS), default=[1.] * len(EVENTS),
+                        metavar='WEIGHT')
+    events.add_argument('--cost-sigma', help='The standard deviation of the '
+                        'logarithm of the factor applied to a changed cost',
+                        type=float, default=.5)
+    args = parse_commandline(parser)
+    apply_queries(args)
+    return args
+
+
+def apply_event(queries, pool, args):
+    """Apply a random event to the query set
+    :queries: the running queries, updated in place
+    :pool: the queries that can be added, consumed in place
+    :return: the kind of event, and the number of queries it changed"""
+    weights = dict(itertools.izip(EVENTS, args.event_weights))
+    if not pool:
+        weights['add'] = 0
+    if len(queries) < 2:
+        weights['remove'] = 0
+    costly = [q for q in queries if q.cost > 0]
+    if not costly:
+        weights['cost'] = 0
+    kind = _weighted_choice(weights)
+    if kind == 'add':
+        changed = pool[-args.batch:]
+        del pool[-args.batch:]
+        queries.extend(changed)
+    elif kind == 'remove':
+        changed = random.sample(queries, min(args.batch, len(queries) - 1))
+        removed = set(changed)
+        queries[:] = [q for q in queries if q not in removed]
+    elif kind == 'cost':
+        changed = random.sample(costly, min(args.batch, len(costly)))
+        for q in changed:
+            q.cost *= random.lognormvariate(0, args.cost_sigma)
+    else:
+        return None, 0
+    return kind, len(changed)
+
+
+def repair(schedule, queries, budget):
+    """Turn the previous schedule into a schedule of the current queries
+    :schedule: the previous schedule
+    :queries: the current queries
+    :budget: the budget of every slot
+    :return: the repaired schedule, or None if some query cannot be
+             scheduled"""
+    current = set(queries)
+    slots = [[q for q in slot if q in current] for slot in schedule]
+    slots.extend([] for _ in xrange(budget.max_slots - len(slots)))
+    count = dict.fromkeys(queries, 0)
+    for slot in slots:
+        for q in slot:
+            count[q] += 1
+    left = []
+    for slot in slots:
+        used = sum(q.cost for q in slot)
+        if used <= budget.using:
+            left.append(budget.using - used)
+            continue
+        # Shed the most expensive queries, preferably those running in
+        # other slots
+        slot.sort(key=lambda q: (count[q] > 1, q.cost))
+        while used > budget.using:
+            q = slot.pop()
+            used -= q.cost
+            count[q] -= 1
+        left.append(budget.using - used)
+    unscheduled = sorted((q for q, c in count.iteritems() if not c),
+                         key=lambda q: -q.cost)
+    for q in unscheduled:
+        # The slot with the most budget left, then with the fewest queries
+        idx = max(xrange(len(slots)),
+                  key=lambda i: (left[i], -len(slots[i])))
+        if q.cost > left[idx]:
+            return None
+        slots[idx].append(q)
+        left[idx] -= q.cost
+    return slots
+
+
+def reschedule(mode, f, previous, queries, budget):
+    """Compute the schedule of the queries after an event
+    :mode: one of MODES
+    :f: the ILP algorithm
+    :previous: the schedule before the event
+    :return: the schedule, the time spent repairing the previous schedule
+             (None for a cold solve), and the full solve time of the ILP
+             algorithm (None if the repair succeeded)
+    :raise: ilp.NoSchedule"""
+    repair_time = None
+    if mode == 'warm':
+        schedule, measures = timing.measure(repair, previous, queries,
+                                            budget)
+        repair_time = measures['time']
+        if schedule is not None:
+            return schedule, repair_time, None
+        LOG.info('The warm start of %s failed, solving from scratch', f)
+    schedule, measures = timing.measure(ilp.balance_and_schedule,
+                                        queries, budget, f)
+    return schedule, repair_time, measures['time']
+
+
+def run(point, args, repeat):
+    """Apply the events to the query set built for a sweep point, and
+    reschedule it with every ILP algorithm after every event"""
+    args = point.apply(args)
+    budget = build_budget(args)
+    # Build the queries that will be added along with the initial ones
+    pool_args = copy.copy(args)
+    pool_args.query_count = args.query_count + args.events * args.batch
+    queries = build_queries(budget, pool_args, repeat)
+    if queries is None:
+        return
+    random.shuffle(queries)
+    pool = queries[args.query_count:]
+    queries = queries[:args.query_count]
+    LOG.info("Built %d queries with %s and %d slots", len(queries),
+             str(budget).replace('\n', '').replace('   ', ''),
+             budget.max_slots)
+    common = {'timeslots': args.timeslots,
+              'using': args.using, 'active': args.active_ratio,
+              'passive': args.passive_ratio, 'graph': args.query_graph}
+    schedules = {}
+    for f in args.restrict:
+        try:
+            initial = ilp.balance_and_schedule(queries, budget, f)
+        except ilp.NoSchedule as e:
+            LOG.error("%s could not compute a schedule for %s: %s", f, args,
+                      e)
+            continue
+        for mode in MODES:
+            schedules[f, mode] = initial
+    for event in xrange(args.events):
+        kind, changed = apply_event(queries, pool, args)
+        if kind is None:
+            LOG.warning('No event can be applied to %d queries',
+                        len(queries))
+            break
+        for (f, mode), previous in sorted(schedules.iteritems()):
+            res = dict(common, event=event, kind=kind, changed=changed,
+                       mode=mode, function=f, query_count=len(queries))
+            try:
+                schedule, repair_time, solve_time = reschedule(
+                    mode, f, previous, queries, budget)
+            except ilp.NoSchedule as e:
+                LOG.error("%s could not reschedule %s after %s: %s", f,
+                          mode, kind, e)
+                res['time'] = -1
+                yield res
+                continue
+            schedules[f, mode] = schedule
+            res.update(Occupancy(schedule, queries).summary(budget))
+            res.update(time=(repair_time or 0.) + (solve_time or 0.),
+                       repair_time=repair_time, solve_time=solve_time,
+                       fallback=mode == 'warm' and solve_time is not None,
+                       perturbed=perturbed_slots(previous, schedule))
+            yield res
+
+
+def _weighted_choice(weights):
+    """:return: a key of weights, with a probability proportional to its
+                value, or None if they are all null"""
+    total = sum(weights.itervalues())
+    if total <= 0:
+        return None
+    x = random.random() * total
+    for key in EVENTS:
+        x -= weights[key]
+        if x < 0 and weights[key] > 0:
+            return key
+    return max(EVENTS, key=weights.get)
+
+
+def main():
+    args = parse_args()
+    points = [SweepPoint(*values) for values in
+              itertools.product(*(getattr(args, arg) for arg, _ in SWEPT))]
+    LOG.info('Sweeping over %d points', len(points))
+    with results_writer(args.out, FIELDS) as writer:
+        run_sweep(points, run, writer, args, isolate=True)
+
+
+if __name__ == '__main__':
+    main()
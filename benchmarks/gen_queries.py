@@ -0,0 +1,55 @@
+"""
+Generate the query workload of the scheduling benchmark, from the paths of
+the key point sampling and confinement benchmarks on every (graph,
+repetition), see queries.py. The benchmark can then read it with --queries.
+"""
+import logging
+import random
+
+from . import queries
+from .parse import (init_parser, parse_commandline, parse_paths, parse_topo,
+                    build_graphs, build_paths)
+from .runner import restored_egresses, unit_seed
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.INFO)
+
+
+def parse_args():
+    parser = init_parser(
+        description='Query workload generator for the scheduling benchmark',
+        epilog='The workload is written in the --out file.')
+    parse_paths(parser)
+    parse_topo(parser)
+    queries.parse_generation(parser)
+    args = parse_commandline(parser)
+    if args.workload:
+        parser.error('--workload cannot be used to generate queries')
+    return args, build_graphs(args)
+
+
+def main():
+    args, graphs = parse_args()
+    with open(args.out, 'w') as outfile:
+        writer = queries.QueryWorkloadWriter(outfile, args)
+        for graph in graphs:
+            g = graph.build()
+            if g is None:
+                continue
+            for repeat in xrange(args.repeat):
+                # Same graph, seed and paths as the work unit of the
+                # key point sampling and confinement benchmarks
+                with restored_egresses(g):
+                    random.seed(unit_seed(args.seed, g.name, repeat))
+                    active, passive = queries.generate(
+                        g, build_paths(g, args), args)
+                writer.add(g.name, repeat, active, passive,
+                           g.features.summary())
+                LOG.info('Generated %d active and %d passive queries for %s '
+                         '(repetition %d)', len(active), len(passive),
+                         g.name, repeat)
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
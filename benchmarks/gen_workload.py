@@ -0,0 +1,55 @@
+"""
+Generate the workload of the key point sampling and confinement benchmarks,
+i.e. the egresses and paths of every (graph, repetition), as they would be
+generated by the benchmarks themselves. The benchmarks can then read it with
+--workload, see workload.py.
+"""
+import itertools
+import logging
+import random
+
+from .parse import (init_parser, parse_commandline, parse_paths, parse_topo,
+                    build_graphs, build_paths)
+from .runner import restored_egresses, unit_seed
+from .workload import WorkloadWriter
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.INFO)
+
+
+def parse_args():
+    parser = init_parser(
+        description='Workload generator for the key point sampling and '
+        'confinement benchmarks',
+        epilog='The workload is written in the --out file.')
+    parse_paths(parser)
+    parse_topo(parser)
+    args = parse_commandline(parser)
+    if args.workload:
+        parser.error('--workload cannot be used to generate a workload')
+    return args, build_graphs(args)
+
+
+def main():
+    args, graphs = parse_args()
+    with open(args.out, 'wb') as outfile:
+        writer = WorkloadWriter(outfile, args)
+        for graph in graphs:
+            g = graph.build()
+            if g is None:
+                continue
+            for repeat in xrange(args.repeat):
+                # Same graph and seed as the work unit of the benchmarks
+                with restored_egresses(g):
+                    random.seed(unit_seed(args.seed, g.name, repeat))
+                    # The benchmarks stop after max_path + 1 paths
+                    paths = list(itertools.islice(build_paths(g, args),
+                                                  args.max_path + 1))
+                    writer.add(g.name, repeat, g.egresses, paths)
+                LOG.info('Generated %d paths for %s (repetition %d)',
+                         len(paths), g.name, repeat)
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
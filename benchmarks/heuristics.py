@@ -5,13 +5,30 @@ i.e. egresses locations.
 """
 import random
 import abc
+import collections
 import itertools
 import logging
+import math
+import time
 
 import networkx as nx
 
+from .utils import IndexedSet
+
 LOG = logging.getLogger(__name__)
 
+# The default number of random paths drawn per pair of egresses
+PATH_SAMPLES = 10
+# The default time budget (in seconds) to draw the random paths of a pair
+PATH_BUDGET = 1.
+# The number of random walks per requested path, beyond which no more walks
+# are done even if the time budget is not exhausted
+WALKS_PER_SAMPLE = 20
+# The orders in which the pairs of egresses can be used: all the paths of a
+# pair before moving to the next one, or one path per pair in turn, with the
+# pairs in a fixed or random order
+PAIR_ORDERS = ['sequential', 'round-robin', 'random']
+
 
 class Heuristic(object):
     @classmethod
@@ -69,15 +86,44 @@ class RandomEgresses(Egresses):
 class Path(Heuristic):
     __metaclass__ = abc.ABCMeta
 
-    def __call__(self, g, **kw):
+    def __call__(self, g, count=None, pair_order='sequential', **kw):
+        """Yield the paths between the pairs of egresses of the graph
+        :param count: (opt) the number of paths after which to stop
+        :param pair_order: the order of the pairs, one of PAIR_ORDERS"""
         egresses = g.egresses
         if not egresses:
             __e = random.choice(g.nodes())
             egresses = [__e, __e]
-        for u, v in itertools.combinations(g.egresses, 2):
-            for p in self.path(g, src=u, dst=v, **kw):
-                if len(p) > 2 and len(p) <= kw.get('maxlen', 20):
-                    yield p
+        maxlen = kw.get('maxlen', 20)
+        pairs = list(itertools.combinations(egresses, 2))
+        if pair_order == 'random':
+            random.shuffle(pairs)
+        hops = {}
+        streams = (self._paths(g, u, v, maxlen, kw) for u, v in pairs
+                   if self.min_len(g, u, v, maxlen, hops) <= maxlen)
+        if pair_order == 'sequential':
+            paths = itertools.chain.from_iterable(streams)
+        else:
+            paths = _round_robin(streams)
+        return itertools.islice(paths, count)
+
+    def _paths(self, g, src, dst, maxlen, kw):
+        for p in self.path(g, src=src, dst=dst, **kw):
+            if len(p) > 2 and len(p) <= maxlen:
+                yield p
+
+    @staticmethod
+    def min_len(g, src, dst, maxlen, hops):
+        """Return a lower bound on the length of the paths between two nodes,
+        any value above maxlen if it is larger than maxlen
+        :param hops: a cache of the hop counts from the sources, shared
+                     across the calls"""
+        try:
+            reachable = hops[src]
+        except KeyError:
+            reachable = hops[src] = nx.single_source_shortest_path_length(
+                g, src, cutoff=maxlen - 1)
+        return reachable[dst] + 1 if dst in reachable else maxlen + 1
 
     @abc.abstractmethod
     def path(self, g, src, dst, maxlen=None):
@@ -108,7 +154,7 @@ class PerturbedSPT(Path):
         nlen = int(len(g.spt[src][dst][0]) * (1 + perturb))
         if nlen > maxlen:
             return []
-        return RandomPath.path(g, src, dst, maxlen=nlen)
+        return RandomPath.path(g, src, dst, maxlen=nlen, **kw)
 
 
 class RandomPath(Path):
@@ -117,8 +163,11 @@ class RandomPath(Path):
     KEY = 'random'
 
     @staticmethod
-    def path(g, src, dst, maxlen=None, **kw):
-        return nx.all_simple_paths(g, src, dst, cutoff=maxlen)
+    def path(g, src, dst, maxlen=None, samples=PATH_SAMPLES,
+             budget=PATH_BUDGET, **kw):
+        if maxlen is None:
+            maxlen = len(g) - 1
+        return sample_simple_paths(g, src, dst, maxlen, samples, budget)
 
 
 class Region(Path):
@@ -128,16 +177,21 @@ class Region(Path):
 
     @staticmethod
     def path(g, src, dst, maxlen=None, region_count=None, **kw):
+        # All regions grow from the same shortest path
+        spt = g.spt[src][dst][0]
+        core = frozenset(spt)
+        core_frontier = IndexedSet(nei for n in spt
+                                   for nei in g.neighbors_iter(n)
+                                   if nei not in core)
         for _ in xrange(region_count):
-            region = set(g.spt[src][dst][0])
-            r_nodes = set(itertools.chain.from_iterable(
-                g.neighbors_iter(n) for n in region)).difference(region)
+            region = set(core)
+            r_nodes = core_frontier.copy()
             while len(region) < maxlen and r_nodes:
-                n = random.choice(list(r_nodes))
-                r_nodes.remove(n)
+                n = r_nodes.pop_random()
                 region.add(n)
-                r_nodes.update(nei for nei in g.neighbors_iter(n)
-                               if nei not in region)
+                for nei in g.neighbors_iter(n):
+                    if nei not in region:
+                        r_nodes.add(nei)
             yield region
 
 
@@ -146,16 +200,119 @@ class Island(Path):
 
     KEY = 'island'
 
+    @staticmethod
+    def min_len(g, src, dst, maxlen, hops):
+        # Islands do not depend on the pair of egresses
+        return 0
+
     @staticmethod
     def path(g, src, dst, maxlen=None, region_count=None, **kw):
+        nodes = g.nodes()
         for _ in xrange(region_count):
-            region = set([random.choice(g.nodes())])
-            left = region.copy()
+            region = set([random.choice(nodes)])
+            left = IndexedSet(region)
             explored = set()
             while len(region) < maxlen and len(region) < len(g) and left:
-                n = left.pop()
-                nei = set(g.neighbors_iter(n))
-                region.update(nei)
+                n = left.pop_random()
                 explored.add(n)
-                left.update(nei.difference(explored))
+                region.update(g.neighbors_iter(n))
+                for nei in g.neighbors_iter(n):
+                    if nei not in explored:
+                        left.add(nei)
             yield region
+
+
+def _round_robin(iterables):
+    """Yield one item of every iterable in turn, until they are all
+    exhausted. The iterables are only started when they are first reached"""
+    active = []
+    for iterable in iterables:
+        it = iter(iterable)
+        for item in it:
+            yield item
+            active.append(it)
+            break
+    while active:
+        left = []
+        for it in active:
+            for item in it:
+                yield item
+                left.append(it)
+                break
+        active = left
+
+
+def sample_simple_paths(g, src, dst, cutoff, count, budget=PATH_BUDGET):
+    """Draw random simple paths between two nodes, close to uniformly.
+
+    Every random walk starts at src and steps to a random unvisited
+    neighbor, among those that can still reach dst within the cutoff, until
+    it reaches dst or is stuck. Each walk that reaches dst is weighted by
+    the inverse of its probability, i.e. the product of the number of
+    choices at each step. The paths are then drawn among the walks with
+    probabilities proportional to these weights.
+
+    :param g: The graph on which paths should be drawn
+    :param src: The first node of the paths
+    :param dst: The last node of the paths
+    :param cutoff: The maximal number of hops of the paths
+    :param count: The number of distinct paths to draw
+    :param budget: The time (in seconds) after which no more walks are done
+    :return: A list of at most count paths"""
+    hops_to = _hops_to(g, dst, cutoff)
+    if src not in hops_to:
+        return []
+    deadline = time.time() + budget
+    weights = collections.OrderedDict()
+    for _ in xrange(count * WALKS_PER_SAMPLE):
+        if time.time() > deadline:
+            break
+        path, weight = _random_walk(g, src, dst, cutoff, hops_to)
+        if path:
+            weights[path] = weight
+    if not weights:
+        return []
+    # Weighted sampling without replacement (Efraimidis and Spirakis), with
+    # the weights normalized as their product can get large
+    top = max(weights.itervalues())
+    keys = [(math.log(random.random() or 1e-300) * top / w, p)
+            for p, w in weights.iteritems()]
+    keys.sort(reverse=True)
+    return [list(p) for _, p in keys[:count]]
+
+
+def _hops_to(g, dst, cutoff):
+    """Return the number of hops from every node to dst, for the nodes that
+    are at most cutoff hops away"""
+    hops = {dst: 0}
+    frontier = [dst]
+    for h in xrange(1, cutoff + 1):
+        next_frontier = []
+        for v in frontier:
+            for u in g.predecessors_iter(v):
+                if u not in hops:
+                    hops[u] = h
+                    next_frontier.append(u)
+        frontier = next_frontier
+    return hops
+
+
+def _random_walk(g, src, dst, cutoff, hops_to):
+    """Walk randomly from src towards dst
+    :return: the path as a tuple, or None if the walk got stuck, and the
+             inverse of the probability of the walk"""
+    path = [src]
+    visited = set(path)
+    weight = 1.
+    u = src
+    while u != dst:
+        left = cutoff - len(path)
+        choices = [v for v in g.neighbors_iter(u)
+                   if v not in visited and hops_to.get(v, cutoff + 1) <= left]
+        if not choices:
+            return None, weight
+        weight *= len(choices)
+        u = random.choice(choices)
+        path.append(u)
+        visited.add(u)
+    return tuple(path), weight
@@ -2,13 +2,17 @@
 Common definition to parse the command line.
 """
 import random
-import itertools
 import argparse
+import itertools
 import logging
 
-from .heuristics import Path, Egresses
-from .topologies.rf import get_topo as rf
-from .topologies.topozoo import get_topo as zoo
+from . import timing
+from .heuristics import (Path, Egresses, PATH_SAMPLES, PATH_BUDGET,
+                         PAIR_ORDERS)
+from .queries import QueryWorkload
+from .topologies import CACHE_DIR
+from .topologies import rf, topozoo as zoo
+from .workload import Workload, PARAMS as WORKLOAD_PARAMS
 
 from stroboscope.requirements import Budget
 
@@ -32,6 +36,11 @@ ZOO_TOPOS = [
 EGRESSES = Egresses.heuristics()
 PATH = Path.heuristics()
 
+# The workload files opened by this process, by file name
+_WORKLOADS = {}
+# The query workload files opened by this process, by file name
+_QUERY_WORKLOADS = {}
+
 
 def init_parser(description='', epilog='', default_timeout=30):
     parser = argparse.ArgumentParser(description=description,
@@ -49,6 +58,9 @@ def init_parser(description='', epilog='', default_timeout=30):
                         default=default_timeout)
     genprm.add_argument('--repeat', help='Repeat each experiment a number of '
                         'time', default=1, type=int)
+    genprm.add_argument('--jobs', help='The number of worker processes '
+                        'running the experiments', default=1, type=int)
+    timing.parse_timing(parser)
     return parser
 
 
@@ -58,6 +70,7 @@ def parse_commandline(parser):
         logging.disable(logging.DEBUG)
     LOG.info('Seeding specification generator with: %s', args.seed)
     random.seed(args.seed)
+    timing.setup(args)
     return args
 
 
@@ -75,6 +88,12 @@ def parse_paths(parser):
                        'egresses', type=int, default=2)
     paths.add_argument('--region-count', help='The number of regions to '
                        'define', type=int, default=10)
+    paths.add_argument('--path-samples', help='The number of random paths '
+                       'drawn per pair of egresses', type=int,
+                       default=PATH_SAMPLES)
+    paths.add_argument('--path-budget', help='The time (in seconds) spent at '
+                       'most drawing the random paths of a pair of egresses',
+                       type=float, default=PATH_BUDGET)
     paths.add_argument('--egress-selection',
                        help='Egresses selection heuristic',
                        default='low_degree',
@@ -83,14 +102,54 @@ def parse_paths(parser):
                        help='Paths selection heuristic',
                        default='perturb',
                        choices=PATH.keys())
+    paths.add_argument('--pair-order',
+                       help='The order in which the pairs of egresses are '
+                       'used: all the paths of a pair before the next one, '
+                       'or one path per pair in turn, in a fixed or random '
+                       'pair order', default='random', choices=PAIR_ORDERS)
+    paths.add_argument('--workload', help='Read the egresses and paths from '
+                       'this workload file (see gen_workload) rather than '
+                       'generating them, which overrides the other path '
+                       'selection parameters and the topologies')
+
 
+def apply_workload(args):
+    """Replace the arguments defining the paths by those of the workload
+    given on the command line, if any"""
+    if not args.workload:
+        return
+    workload = _WORKLOADS[args.workload] = Workload(args.workload)
+    for param in WORKLOAD_PARAMS:
+        setattr(args, param, workload.params[param])
+    LOG.info('Using workload %s: %s', args.workload, workload.params)
 
-def build_paths(graph, args):
+
+def build_paths(graph, args, repeat=None):
+    """Register the egresses of the graph and return its paths
+    :repeat: the repetition of the work unit, to find its paths in the
+             workload file if any"""
+    if args.workload:
+        workload = _WORKLOADS.get(args.workload)
+        if workload is None:
+            workload = _WORKLOADS[args.workload] = Workload(args.workload)
+        try:
+            egresses, paths = workload.load(graph.name, repeat)
+        except KeyError:
+            LOG.error('No paths for %s (repetition %s) in %s', graph.name,
+                      repeat, args.workload)
+            return []
+        for e in egresses:
+            graph.register_egress(e)
+        return paths
     EGRESSES[args.egress_selection](graph, percentage=args.egress_percentage,
                                     degree=args.egress_degree)
     return PATH[args.path_selection](graph, maxlen=args.max_len,
                                      region_count=args.region_count,
-                                     perturb=args.path_perturb)
+                                     perturb=args.path_perturb,
+                                     samples=args.path_samples,
+                                     budget=args.path_budget,
+                                     pair_order=args.pair_order,
+                                     count=args.max_path + 1)
 
 
 def parse_topo(parser):
@@ -102,28 +161,122 @@ def parse_topo(parser):
     topos.add_argument('-r', '--rocketfuel', help='Similar to -z but for the '
                        'rocketfuel topologies (see topologies/rocketfuel)',
                        nargs='*', default=RF_TOPOS)
+    topos.add_argument('--graph-cache', help='The directory where the '
+                       'sanitized graphs are cached', default=CACHE_DIR)
+    topos.add_argument('--no-graph-cache', help='Do not cache the sanitized '
+                       'graphs', dest='graph_cache', action='store_const',
+                       const=None)
+    topos.add_argument('--compact-spt', help='Rebuild the shortest paths on '
+                       'demand from a distance matrix rather than keeping '
+                       'them all in memory, for the largest graphs',
+                       action='store_true', default=False)
+
+
+class LazyGraph(object):
+    """A graph from the topology zoo or the rocketfuel topology set, which is
+    only built when needed"""
+
+    def __init__(self, name, source, args):
+        """:name: the topology name
+        :source: the topology module, i.e. rf or zoo
+        :args: the parsed command line arguments"""
+        self.name = name
+        self.source = source
+        self.size = source.get_size(name)
+        self.seed = args.seed
+        self.cache_dir = args.graph_cache
+        self.compact_spt = args.compact_spt
+
+    def __len__(self):
+        return self.size
+
+    def build(self):
+        """Build and sanitize the graph, which is always the same as the RNG
+        is seeded from the topology name
+        :return: the graph, or None if it could not be built"""
+        random.seed('%s-%s' % (self.seed, self.name))
+        return self.source.get_topo(self.name, cache_dir=self.cache_dir,
+                                    compact_spt=self.compact_spt)
 
 
 def build_graphs(args):
-    """Build a set of graphs from the topology zoo and/or the rocketfuel
-    topology set"""
+    """List the graphs from the topology zoo and/or the rocketfuel topology
+    set, by increasing number of nodes (before sanitization). The graphs are
+    not built yet, see LazyGraph"""
     rf_topos = args.rocketfuel
     zoo_topos = args.zoo
-    LOG.debug('Building graphs rf:%s, zoo:%s', rf_topos, zoo_topos)
-    graphs = filter(None, (zoo(n) for n in zoo_topos))
-    graphs.extend(itertools.ifilter(None, (rf(n) for n in rf_topos)))
+    LOG.debug('Listing graphs rf:%s, zoo:%s', rf_topos, zoo_topos)
+    graphs = [LazyGraph(n, zoo, args) for n in zoo_topos]
+    graphs.extend(LazyGraph(n, rf, args) for n in rf_topos)
+    graphs = [g for g in graphs if g.size is not None]
     graphs.sort(key=len)
     return graphs
 
 
-def parse_budget(parser):
+def series(cast):
+    """Return an argparse type parsing either a single value, or a series of
+    values as START:STOP:STEP or START:STOP:*FACTOR, STOP being included
+    :cast: the type of the values"""
+    def parse(spec):
+        parts = spec.split(':')
+        if len(parts) == 1:
+            return [cast(spec)]
+        try:
+            start, stop = cast(parts[0]), cast(parts[1])
+            geometric = parts[2].startswith('*')
+            step = float(parts[2].lstrip('*'))
+        except (IndexError, ValueError):
+            raise argparse.ArgumentTypeError('Invalid series: %s' % spec)
+        if len(parts) != 3:
+            raise argparse.ArgumentTypeError('Invalid series: %s' % spec)
+        if start > stop:
+            raise argparse.ArgumentTypeError(
+                'Invalid series %s: START is above STOP' % spec)
+        if geometric and (start <= 0 or step <= 1):
+            raise argparse.ArgumentTypeError(
+                'Invalid series %s: a geometric series needs START > 0 and '
+                'FACTOR > 1' % spec)
+        if not geometric and step <= 0:
+            raise argparse.ArgumentTypeError(
+                'Invalid series %s: STEP must be positive' % spec)
+        values = []
+        for i in itertools.count():
+            v = start * step ** i if geometric else start + step * i
+            if v > stop * (1 + 1e-9):
+                break
+            v = cast(round(v, 9)) if cast is not int else int(round(v))
+            if v not in values:
+                values.append(v)
+        return values
+    return parse
+
+
+class _Series(argparse.Action):
+    """Concatenate the series of values given to an argument"""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        setattr(namespace, self.dest,
+                list(itertools.chain.from_iterable(values)))
+
+
+def _add_param(group, flag, sweep=False, **kw):
+    """Add an argument, which accepts series of values if sweep is set"""
+    if sweep:
+        kw.update(type=series(kw['type']), default=[kw['default']],
+                  nargs='+', action=_Series)
+        kw['help'] += (', one or more values or series of values as '
+                       'START:STOP:STEP or START:STOP:*FACTOR')
+    group.add_argument(flag, **kw)
+
+
+def parse_budget(parser, sweep=False):
     budget = parser.add_argument_group('Budget parameter')
     budget.add_argument('--gap', help='The MIP GAP allowed from the optimal',
                         default=.05, type=float)
-    budget.add_argument('--timeslots', help='The timeslot count',
-                        default=150, type=int)
-    budget.add_argument('--using', help='The budget ratio wrt. mean query '
-                        'demands', default=2, type=float)
+    _add_param(budget, '--timeslots', sweep, help='The timeslot count',
+               default=150, type=int)
+    _add_param(budget, '--using', sweep, help='The budget ratio wrt. mean '
+               'query demands', default=2, type=float)
 
 
 def build_budget(args):
@@ -133,22 +286,82 @@ def build_budget(args):
     return budget
 
 
-def parse_queries(parser):
+def parse_queries(parser, sweep=False):
     cnt_queries = parser.add_argument_group('Query counts')
-    cnt_queries.add_argument('--query-count', help='The number of queries to '
-                             'generate', default=150, type=int)
-    cnt_queries.add_argument('--active-ratio', help='The ratio of pure active '
-                             'queries', default=.5, type=float)
-    cnt_queries.add_argument('--passive-ratio', help='The ratio of pure '
-                             'passive queries', default=.5, type=float)
+    _add_param(cnt_queries, '--query-count', sweep, help='The number of '
+               'queries to generate', default=150, type=int)
+    _add_param(cnt_queries, '--active-ratio', sweep, help='The ratio of pure '
+               'active queries', default=.5, type=float)
+    _add_param(cnt_queries, '--passive-ratio', sweep, help='The ratio of pure '
+               'passive queries', default=.5, type=float)
     cnt_queries.add_argument('--demand-ratio-avg', help='The average flow'
                              'demands', type=float, default=100)
     cnt_queries.add_argument('--demand-ratio-stdev', help='The associated '
                              'stdev for the demands',
                              default=25, type=float)
+    cnt_queries.add_argument('--queries', help='Select the queries from '
+                             'this query workload file (see gen_queries) '
+                             'rather than drawing their costs, which '
+                             'overrides the demand parameters')
+    _add_param(cnt_queries, '--query-graph', sweep, help='The graph of the '
+               'query workload whose queries are used, all of them by '
+               'default', default=None, type=str)
+
+
+def apply_queries(args):
+    """Replace the demand parameters by those of the query workload given on
+    the command line, if any"""
+    if not args.queries:
+        return
+    workload = _query_workload(args)
+    args.demand_ratio_avg = workload.params['demand_avg']
+    # The demands are heavy-tailed rather than normally distributed
+    args.demand_ratio_stdev = None
+    if args.query_graph == [None]:
+        args.query_graph = workload.graphs
+    elif args.query_graph is None:
+        args.query_graph = workload.graphs[0]
+    LOG.info('Using query workload %s: %s', args.queries, workload.params)
+
 
+def query_features(args):
+    """:return: the features of the graph of the queries (see
+                TopologyFeatures.summary), empty if they are not selected
+                from a query workload, or if it does not have them"""
+    if not args.queries:
+        return {}
+    return _query_workload(args).features.get(args.query_graph, {})
+
+
+def _query_workload(args):
+    """Return the query workload given on the command line, reading it once
+    per process"""
+    workload = _QUERY_WORKLOADS.get(args.queries)
+    if workload is None:
+        workload = _QUERY_WORKLOADS[args.queries] = QueryWorkload(
+            args.queries)
+    return workload
+
+
+def build_queries(budget, args, repeat=0):
+    """Build the queries of a benchmark, with costs drawn from a normal
+    distribution, or selected from the query workload if any
+    :repeat: the repetition, to find the queries in the query workload
+    :return: the list of queries, or None if the query workload does not
+             have them"""
+    budget.using = args.demand_ratio_avg * args.using
+    if args.queries:
+        workload = _query_workload(args)
+        try:
+            return workload.select(
+                args.query_graph, repeat,
+                int(args.active_ratio * args.query_count),
+                int(args.passive_ratio * args.query_count))
+        except KeyError:
+            LOG.error('No queries for %s (repetition %s) in %s',
+                      args.query_graph, repeat, args.queries)
+            return None
 
-def build_queries(budget, args):
     class MockQuery(object):
         ID = 0
 
@@ -167,7 +380,6 @@ def build_queries(budget, args):
             return 'Q%d' % self.index
         __str__ = __repr__
 
-    budget.using = args.demand_ratio_avg * args.using
     queries = [MockQuery() for _ in
                xrange(int(args.active_ratio * args.query_count))]
     queries.extend([MockQuery(False) for _ in
@@ -0,0 +1,270 @@
+"""
+Query workloads of the scheduling benchmarks, derived from the topologies.
+
+Rather than drawing independent query costs, the queries are built as they
+would be in a deployment: every query monitors the traffic towards a prefix,
+either by mirroring it on the key points of a path (active queries), or by
+checking that it stays confined within a region (passive queries). The
+locations of the queries are computed by the key point sampling and
+confinement algorithms, on the paths of the benchmarks (see parse_paths).
+
+The traffic demands of the prefixes are heavy-tailed (Pareto), and both the
+prefixes and the paths have a Zipf popularity. The popular paths are thus
+monitored by many queries, whose locations overlap, and every prefix is
+announced by an egress, so that the queries towards a prefix end on the
+same egress when possible.
+
+A query workload file is a JSON document holding the generation parameters
+and the queries of every work unit, i.e. per (graph, repetition), along
+with the features of its graph. The benchmarks then select their queries
+from the workload, see QueryWorkload.select().
+"""
+import bisect
+import itertools
+import json
+import logging
+import random
+
+from stroboscope.algorithms.confine import CONFINE_OPT
+from stroboscope.algorithms.key_points import KPS_OPT
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = 'STRBQW01'
+# The queries mirroring the traffic on the key points of a path
+MIRROR = 'mirror'
+# The queries checking that the traffic is confined within a region
+CONFINE = 'confine'
+# The command line arguments that define a query workload
+PARAMS = ['zoo', 'rocketfuel', 'repeat', 'seed', 'max_path', 'max_len',
+          'path_perturb', 'egress_percentage', 'egress_degree',
+          'region_count', 'egress_selection', 'path_selection',
+          'path_samples', 'path_budget', 'pair_order', 'pool_size',
+          'prefix_count', 'demand_avg', 'demand_shape', 'popularity',
+          'kps_function', 'confine_function']
+
+KPS = {f.__name__: f for f in KPS_OPT}
+CONFINE_FUNCS = {f.__name__: f for f in CONFINE_OPT}
+
+
+class Query(object):
+    """A monitoring query, as seen by the scheduler"""
+
+    def __init__(self, index, kind, prefix, demand, locations):
+        """:index: the position of the query in its work unit
+        :kind: MIRROR or CONFINE
+        :prefix: the monitored prefix
+        :demand: the traffic volume towards the prefix
+        :locations: the nodes (or links) where the query is deployed"""
+        self.index = index
+        self.kind = kind
+        self.prefix = prefix
+        self.demand = demand
+        self.locations = locations
+        # The traffic is mirrored once per key point, while confining it
+        # does not mirror anything as long as it is confined
+        self.cost = demand * len(locations) if kind == MIRROR else 0
+        self.weight = 1
+
+    def __hash__(self):
+        return hash(self.index)
+
+    def __repr__(self):
+        return 'Q%d' % self.index
+    __str__ = __repr__
+
+
+def parse_generation(parser):
+    gen = parser.add_argument_group('Query generation')
+    gen.add_argument('--pool-size', help='The number of active and of '
+                     'passive queries generated per work unit, from which '
+                     'the benchmarks select theirs', type=int, default=1000)
+    gen.add_argument('--prefix-count', help='The number of monitored '
+                     'prefixes per work unit', type=int, default=100)
+    gen.add_argument('--demand-avg', help='The average cost of the active '
+                     'queries, to which their costs are scaled', type=float,
+                     default=100)
+    gen.add_argument('--demand-shape', help='The shape of the Pareto '
+                     'distribution of the prefix demands, the lower the '
+                     'heavier its tail', type=float, default=1.5)
+    gen.add_argument('--popularity', help='The exponent of the Zipf '
+                     'popularity of the prefixes and paths, 0 for uniform',
+                     type=float, default=1.)
+    gen.add_argument('--kps-function', help='The key point sampling '
+                     'algorithm locating the active queries',
+                     choices=sorted(KPS), default=KPS_OPT[-1].__name__)
+    gen.add_argument('--confine-function', help='The confinement algorithm '
+                     'locating the passive queries',
+                     choices=sorted(CONFINE_FUNCS),
+                     default=CONFINE_OPT[-1].__name__)
+
+
+def generate(g, paths, args):
+    """Generate the queries of a work unit
+    :g: its graph, with its egresses registered
+    :paths: the paths (or regions) of the work unit, see parse.build_paths
+    :args: the parsed command line arguments, see parse_generation
+    :return: the list of active queries, and the list of passive ones. The
+             paths on which the location algorithms fail are skipped, and
+             regions only have passive queries, as they have no key points"""
+    paths = list(paths)
+    if not paths:
+        return [], []
+    regions = isinstance(paths[0], (set, frozenset))
+    if regions:
+        LOG.warning('The %s path selection yields regions, only generating '
+                    'passive queries', args.path_selection)
+    prefixes = ['p%d' % i for i in xrange(args.prefix_count)]
+    demand = {p: random.paretovariate(args.demand_shape) for p in prefixes}
+    # Every prefix is announced by an egress, the queries towards a prefix
+    # are thus preferably on the paths ending at that egress
+    announced = {}
+    for p in prefixes:
+        announced.setdefault(random.choice(g.egresses), []).append(p)
+    pick_announced = {e: _zipf(len(ps), args.popularity)
+                      for e, ps in announced.iteritems()}
+    pick_prefix = _zipf(len(prefixes), args.popularity)
+    pick_path = _zipf(len(paths), args.popularity)
+    # The locations of every path, computed once as the popular paths are
+    # drawn by many queries, None if the algorithm failed on the path
+    locations = {}
+
+    def draw(kind, locate):
+        queries = []
+        failed = 0
+        while len(queries) < args.pool_size and failed < len(paths):
+            pidx = pick_path()
+            path = paths[pidx]
+            if (kind, pidx) not in locations:
+                try:
+                    locations[kind, pidx] = locate(g, path)
+                except Exception:
+                    LOG.exception('%s failed on %s, skipping it',
+                                  locate.__name__, path)
+                    locations[kind, pidx] = None
+                    failed += 1
+            if locations[kind, pidx] is None:
+                continue
+            egress = None if regions else path[-1]
+            if egress in announced:
+                prefix = announced[egress][pick_announced[egress]()]
+            else:
+                prefix = prefixes[pick_prefix()]
+            queries.append((kind, prefix, locations[kind, pidx]))
+        return queries
+
+    active = [] if regions else draw(MIRROR, KPS[args.kps_function])
+    passive = draw(CONFINE, CONFINE_FUNCS[args.confine_function])
+    # Scale the demands to the requested average cost of the active queries
+    total = sum(demand[p] * len(loc) for _, p, loc in active)
+    scale = args.demand_avg * len(active) / total if total else 1.
+    queries = [Query(i, kind, p, demand[p] * scale, loc)
+               for i, (kind, p, loc) in enumerate(active + passive)]
+    return queries[:len(active)], queries[len(active):]
+
+
+class QueryWorkloadWriter(object):
+    """Write the work units of a query workload file"""
+
+    def __init__(self, f, args):
+        """:f: the file where the workload is written
+        :args: the parsed command line arguments, see PARAMS"""
+        self.f = f
+        self.params = {p: getattr(args, p) for p in PARAMS}
+        self.units = []
+
+    def add(self, graph, repeat, active, passive, features=None):
+        """Add a work unit
+        :graph: the name of its graph
+        :repeat: its repetition
+        :active: its active queries
+        :passive: its passive queries
+        :features: the features of its graph, see TopologyFeatures.summary"""
+        self.units.append({'graph': graph, 'repeat': repeat,
+                           'features': features or {},
+                           'queries': [(q.kind, q.prefix, q.demand,
+                                        list(q.locations))
+                                       for q in itertools.chain(active,
+                                                                passive)]})
+
+    def close(self):
+        """Write the workload"""
+        json.dump({'magic': MAGIC, 'params': self.params,
+                   'units': self.units}, self.f)
+
+
+class QueryWorkload(object):
+    """A query workload file"""
+
+    def __init__(self, filename):
+        """:filename: the workload file name
+        :raise: ValueError if this is not a query workload file"""
+        with open(filename, 'r') as f:
+            try:
+                content = json.load(f)
+            except ValueError:
+                content = None
+        if not isinstance(content, dict) or content.get('magic') != MAGIC:
+            raise ValueError('%s is not a query workload file' % filename)
+        self.params = content['params']
+        self.graphs = []
+        self.units = {}
+        # The features of every graph, empty for the older workloads
+        self.features = {}
+        for unit in content['units']:
+            graph = _decode(unit['graph'])
+            if graph not in self.graphs:
+                self.graphs.append(graph)
+            self.units[graph, unit['repeat']] = unit['queries']
+            self.features[graph] = {str(k): v for k, v in
+                                    unit.get('features', {}).iteritems()}
+
+    def __contains__(self, unit):
+        return unit in self.units
+
+    def select(self, graph, repeat, active, passive):
+        """Select the queries of a benchmark in a work unit, which are the
+        first ones of every kind, so that the smaller query sets are subsets
+        of the larger ones
+        :graph: the name of its graph
+        :repeat: its repetition
+        :active: the number of active queries
+        :passive: the number of passive queries
+        :return: the list of queries
+        :raise: KeyError if the workload does not have that unit"""
+        queries = self.units[graph, repeat]
+        wanted = {MIRROR: active, CONFINE: passive}
+        selected = []
+        for kind, prefix, demand, locations in queries:
+            if wanted[kind] > 0:
+                wanted[kind] -= 1
+                selected.append(Query(len(selected), kind, _decode(prefix),
+                                      demand, _decode(locations)))
+        if any(wanted.itervalues()):
+            LOG.warning('%s (repetition %s) lacks %d active and %d passive '
+                        'queries', graph, repeat, wanted[MIRROR],
+                        wanted[CONFINE])
+        return selected
+
+
+def _zipf(n, exponent):
+    """:return: a function drawing an index in [0, n), with a probability
+                proportional to 1 / (index + 1) ** exponent"""
+    cumulative = []
+    total = 0.
+    for rank in xrange(1, n + 1):
+        total += 1. / rank ** exponent
+        cumulative.append(total)
+    return lambda: min(n - 1, bisect.bisect_right(cumulative,
+                                                  random.random() * total))
+
+
+def _decode(value):
+    """Restore the nodes and links decoded from JSON, as byte strings and
+    tuples"""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_decode(v) if not isinstance(v, list)
+                else tuple(_decode(v)) for v in value]
+    return value
@@ -0,0 +1,149 @@
+"""
+Execution engine for the benchmarks sweeping over graphs.
+
+The sweep is split in independent work units, one per (graph, repetition),
+which can be spread across a pool of worker processes. Every process only
+builds the graph of the unit it is running, and releases it once it moves on
+to the units of another graph.
+"""
+import contextlib
+import copy
+import csv
+import gc
+import itertools
+import logging
+import multiprocessing
+import os
+import random
+import sys
+
+LOG = logging.getLogger(__name__)
+
+
+# The sweep being run, inherited by the workers when they are forked
+_SWEEP = None
+# The graph currently built in this process, as (graph index, graph)
+_BUILT = None, None
+
+
+def unit_seed(seed, graph, repeat):
+    """Return the random seed of a work unit, which only depends on the
+    global seed and on the unit itself"""
+    return '%s-%s-%d' % (seed, graph, repeat)
+
+
+@contextlib.contextmanager
+def results_writer(filename, fields):
+    """Append the result rows to a CSV file, writing its header if the file
+    is new, and exiting if it has other columns, as the rows would not line
+    up with them
+    :filename: the CSV file
+    :fields: the columns of the rows
+    :return: the csv.DictWriter of the rows"""
+    header = None
+    if os.path.exists(filename):
+        with open(filename, 'r') as infile:
+            header = next(csv.reader(infile), None)
+    if header is not None and header != fields:
+        sys.exit('%s has other columns than the results, write them to '
+                 'another file with --out' % filename)
+    with open(filename, 'a') as outfile:
+        writer = csv.DictWriter(outfile, fields)
+        if header is None:
+            writer.writeheader()
+        yield writer
+
+
+@contextlib.contextmanager
+def restored_egresses(g):
+    """Restore the egresses of a graph, and the attributes of its nodes, when
+    leaving the block. These are all that a work unit changes on its graph,
+    when building its paths (see parse.build_paths), which can thus be
+    reused by the next units rather than copied for each of them"""
+    if not hasattr(g, 'egresses'):
+        # Not a graph, e.g. the sweep points of bench_ilp
+        yield g
+        return
+    egresses = copy.copy(g.egresses)
+    attrs = {n: dict(data) for n, data in g.nodes_iter(data=True)}
+    try:
+        yield g
+    finally:
+        g.egresses = egresses
+        for n, data in g.nodes_iter(data=True):
+            data.clear()
+            data.update(attrs[n])
+
+
+def _graph(gidx):
+    """Return the sanitized graph of index gidx, building it if needed"""
+    global _BUILT
+    if _BUILT[0] != gidx:
+        # Release the previous graph before building the next one
+        _BUILT = None, None
+        gc.collect()
+        _BUILT = gidx, _SWEEP[0][gidx].build()
+    return _BUILT[1]
+
+
+def _run_unit(unit):
+    """Run a work unit
+    :unit: the (graph index, repetition) to run
+    :return: the list of result rows of the unit"""
+    graphs, run, args = _SWEEP
+    gidx, repeat = unit
+    g = _graph(gidx)
+    if g is None:
+        return []
+    # Start every unit from the sanitized graph, regardless of the units
+    # that previously ran in this process
+    with restored_egresses(g):
+        random.seed(unit_seed(args.seed, g.name, repeat))
+        return list(run(g, args, repeat))
+
+
+def run_sweep(graphs, run, writer, args, isolate=False):
+    """Run a benchmark over all graphs, args.repeat times, with args.jobs
+    worker processes. The rows are written in the same order whatever the
+    number of workers.
+    :graphs: the list of graphs to build (see parse.LazyGraph), or more
+             generally of inputs whose build() method returns an object
+             with a name
+    :run: a function (graph, args, repetition) yielding the result rows of
+          a work unit
+    :writer: the csv.DictWriter where the rows are written
+    :args: the parsed command line arguments
+    :isolate: run every work unit in a new worker process, even with a
+              single job"""
+    global _SWEEP, _BUILT
+    units = [(gidx, repeat) for gidx in xrange(len(graphs))
+             for repeat in xrange(args.repeat)]
+    _SWEEP = graphs, run, args
+    pool = None
+    try:
+        if args.jobs > 1 or isolate:
+            LOG.info('Running %d work units with %d workers', len(units),
+                     args.jobs)
+            pool = multiprocessing.Pool(max(1, args.jobs),
+                                        maxtasksperchild=1 if isolate
+                                        else None)
+            results = pool.imap(_run_unit, units)
+        else:
+            results = itertools.imap(_run_unit, units)
+        runid = 0
+        for rows in results:
+            for res in rows:
+                LOG.info("Run %d: %s", runid, res)
+                writer.writerow(res)
+                runid += 1
+        if pool:
+            pool.close()
+    except BaseException:
+        if pool:
+            pool.terminate()
+        raise
+    finally:
+        if pool:
+            pool.join()
+        _SWEEP = None
+        _BUILT = None, None
@@ -0,0 +1,203 @@
+"""
+Run a function in a forked child process, with hard resource limits.
+
+The child inherits the whole state of the parent, so its arguments do not
+need to be picklable, but its result does, as it is sent back over a pipe.
+An exception raised by the function is sent back as a ChildError, as the
+exception itself may not survive pickling. A child that exceeds its limits is
+killed, which is reported as one of the OUTCOMES rather than taking the
+parent down. The child leads its own process group, so that the processes
+it starts, e.g. an external solver, are killed along with it.
+"""
+import cPickle as pickle
+import errno
+import logging
+import os
+import resource
+import select
+import signal
+import time
+import traceback
+
+LOG = logging.getLogger(__name__)
+
+# The function returned normally
+OK = 'ok'
+# The function raised an exception
+ERROR = 'error'
+# The function ran out of wall-clock or CPU time
+TIMEOUT = 'timeout'
+# The function ran out of memory
+OOM = 'oom'
+# The child died for another reason, e.g. a crash of a C extension
+CRASH = 'crash'
+OUTCOMES = [OK, ERROR, TIMEOUT, OOM, CRASH]
+
+
+class ChildError(Exception):
+    """An exception raised by the function called in the child"""
+
+    def __init__(self, types, message):
+        """:types: the qualified names of the class of the exception and of
+                   its base classes
+        :message: the exception message"""
+        super(ChildError, self).__init__(types, message)
+        self.types = types
+        self.message = message
+
+    def __str__(self):
+        return '%s: %s' % (self.types[0], self.message)
+
+    def is_a(self, cls):
+        """:return: whether the exception was an instance of cls"""
+        return _qualname(cls) in self.types
+
+
+def call(f, args=(), kw=None, timeout=None, cpu=None, memory=None):
+    """Call f(*args, **kw) in a child process
+    :timeout: the wall-clock time (in seconds) after which the child is
+              killed
+    :cpu: the CPU time limit (in seconds) of the child
+    :memory: the address space limit (in MB) of the child
+    :return: the outcome, and the result of f if it returned normally, or
+             the ChildError describing the exception it raised, or None"""
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        _child(wfd, f, args, kw or {}, cpu, memory)
+    # Also done by the child, whichever runs first
+    _setpgid(pid)
+    os.close(wfd)
+    try:
+        data, killed = _read(rfd, pid, timeout)
+    except BaseException:
+        # The child no longer gets the interrupts of the terminal, as it is
+        # not in its foreground process group
+        _kill_group(pid)
+        _wait4(pid)
+        raise
+    finally:
+        os.close(rfd)
+    _, status, usage = _wait4(pid)
+    # Do not leave behind the processes started by the child
+    _kill_group(pid)
+    if killed:
+        return TIMEOUT, None
+    if data:
+        try:
+            return pickle.loads(data)
+        except Exception as e:
+            LOG.error('Could not unpickle the result of the child %d: %s',
+                      pid, e)
+            return ERROR, None
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        if sig == signal.SIGXCPU:
+            return TIMEOUT, None
+        if sig == signal.SIGKILL:
+            # The hard CPU limit is one second above the soft one, whose
+            # SIGXCPU may have been ignored. Otherwise, the child was
+            # killed by the OOM killer, as nothing else kills it here.
+            if cpu and usage.ru_utime + usage.ru_stime >= _cpu_limit(cpu):
+                return TIMEOUT, None
+            return OOM, None
+        LOG.error('The child %d was killed by signal %d', pid, sig)
+    else:
+        LOG.error('The child %d exited with status %d without a result',
+                  pid, os.WEXITSTATUS(status))
+    return CRASH, None
+
+
+def _child(wfd, f, args, kw, cpu, memory):
+    """Run f with the resource limits and send its outcome, never returns"""
+    code = 1
+    try:
+        _setpgid(0)
+        if memory:
+            limit = memory * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        if cpu:
+            limit = _cpu_limit(cpu)
+            resource.setrlimit(resource.RLIMIT_CPU, (limit, limit + 1))
+        try:
+            res = OK, f(*args, **kw)
+        except MemoryError:
+            res = OOM, None
+        except Exception as e:
+            LOG.debug(traceback.format_exc())
+            res = ERROR, ChildError([_qualname(c) for c in type(e).__mro__],
+                                    str(e))
+        try:
+            data = pickle.dumps(res, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            data = pickle.dumps((ERROR, ChildError(
+                [_qualname(type(e))], 'Unpicklable result: %s' % e)),
+                pickle.HIGHEST_PROTOCOL)
+        while data:
+            data = data[os.write(wfd, data):]
+        code = 0
+    finally:
+        # Never return to the caller of the parent, nor run its cleanup
+        os._exit(code)
+
+
+def _read(rfd, pid, timeout):
+    """Read everything the child sends, killing it after timeout seconds
+    :return: the data, and whether the child was killed"""
+    deadline = time.time() + timeout if timeout else None
+    chunks = []
+    while True:
+        wait = max(0, deadline - time.time()) if deadline else None
+        try:
+            ready, _, _ = select.select([rfd], [], [], wait)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        if not ready:
+            LOG.warning('Killing the child %d after %ss', pid, timeout)
+            _kill_group(pid)
+            return '', True
+        chunk = os.read(rfd, 65536)
+        if not chunk:
+            return ''.join(chunks), False
+        chunks.append(chunk)
+
+
+def _cpu_limit(cpu):
+    """:return: the soft RLIMIT_CPU of a child, in whole seconds"""
+    return int(cpu + .5) or 1
+
+
+def _setpgid(pid):
+    """Make the child pid (0 for the calling process) lead its own process
+    group"""
+    try:
+        os.setpgid(pid, 0)
+    except OSError as e:
+        # The child already exited, or is already the group leader
+        if e.errno not in (errno.ESRCH, errno.EACCES, errno.EPERM):
+            raise
+
+
+def _kill_group(pid):
+    """Kill the process group led by the child pid, if any is left"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+def _qualname(cls):
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+def _wait4(pid):
+    while True:
+        try:
+            return os.wait4(pid, 0)
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
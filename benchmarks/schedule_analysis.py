@@ -0,0 +1,132 @@
+"""
+Analysis of the schedules computed by the ILP algorithms.
+
+A schedule is turned once into its occupancy matrix, i.e. a boolean matrix
+(queries x slots) telling whether a query runs in a slot. The allocations,
+budget usage and fairness of the schedule are then all derived with array
+operations, which stays cheap for thousands of queries and slots.
+"""
+import itertools
+
+import numpy as np
+
+# The CSV columns reported by Occupancy.summary()
+FIELDS = ['total_alloc', 'min_alloc_count', 'max_alloc_count', 'slots_avg',
+          'slots_stdev', 'slots', 'usage_avg', 'usage_stdev', 'usage_max',
+          'jain', 'lp_bound', 'lp_gap', 'alloc_avg', 'alloc_stdev',
+          'unscheduled']
+
+
+class Occupancy(object):
+    """The occupancy matrix of a schedule"""
+
+    def __init__(self, schedule, queries):
+        """:schedule: the list of slots, each listing the queries it runs
+        :queries: the scheduled queries, which index the rows of the matrix
+        :raise: KeyError if the schedule has a query not in queries"""
+        self.queries = queries
+        self.index = {q: i for i, q in enumerate(queries)}
+        sizes = np.fromiter((len(slot) for slot in schedule), dtype=np.int64,
+                            count=len(schedule))
+        self.rows = np.fromiter((self.index[q] for slot in schedule
+                                 for q in slot), dtype=np.int64,
+                                count=sizes.sum())
+        self.cols = np.repeat(np.arange(len(schedule)), sizes)
+        self.matrix = np.zeros((len(queries), len(schedule)), dtype=bool)
+        self.matrix[self.rows, self.cols] = True
+        self.cost = np.fromiter((q.cost for q in queries), dtype=float,
+                                count=len(queries))
+        self.weight = np.fromiter((q.weight for q in queries), dtype=float,
+                                  count=len(queries))
+
+    @property
+    def slots(self):
+        return self.matrix.shape[1]
+
+    def allocations(self):
+        """:return: the number of slots allocated to every query"""
+        return self.matrix.sum(axis=1)
+
+    def slot_cost(self):
+        """:return: the total cost of the queries of every slot"""
+        return np.bincount(self.cols, weights=self.cost[self.rows],
+                           minlength=self.slots)
+
+    def summary(self, budget):
+        """:budget: the budget given to the scheduler
+        :return: the schedule quality metrics, by CSV column (see FIELDS).
+                 The slots_* and min_alloc_count columns only account for
+                 the scheduled queries, as they always did, while the
+                 alloc_* columns and the fairness account for all queries"""
+        counts = self.allocations()
+        scheduled = counts[counts > 0]
+        usage = self.slot_cost() / budget.using
+        bound = lp_bound(self.cost, self.weight, budget)
+        allocated = np.dot(self.weight, counts)
+        square = np.dot(counts, counts)
+        return {'total_alloc': len(self.rows),
+                'min_alloc_count': (int(scheduled.min()) if len(scheduled)
+                                    else 0),
+                'max_alloc_count': int(counts.max()) if len(counts) else 0,
+                'slots_avg': _mean(scheduled),
+                'slots_stdev': _stdev(scheduled),
+                'slots': self.slots,
+                'usage_avg': _mean(usage),
+                'usage_stdev': _stdev(usage),
+                'usage_max': float(usage.max()) if len(usage) else 0.,
+                # Jain's fairness index of the allocations, 1 if all queries
+                # have as many slots, 1/n if only one has any
+                'jain': (float(counts.sum()) ** 2 / (len(counts) * square)
+                         if square else 0.),
+                'lp_bound': bound,
+                'lp_gap': (bound - allocated) / bound if bound else 0.,
+                'alloc_avg': _mean(counts),
+                'alloc_stdev': _stdev(counts),
+                'unscheduled': len(counts) - len(scheduled)}
+
+
+def lp_bound(cost, weight, budget):
+    """Bound the weighted allocations of any schedule with the LP relaxation
+    of the scheduling problem. Without integrality, the slots are
+    independent, and each is a fractional knapsack: it is filled by
+    decreasing weight per unit of cost, the last query being split.
+    :cost: the cost of every query
+    :weight: the weight of every query
+    :budget: the budget given to the scheduler
+    :return: the bound"""
+    free = cost <= 0
+    free_weight = weight[free].sum()
+    cost, weight = cost[~free], weight[~free]
+    order = np.argsort(-weight / cost, kind='mergesort')
+    cost, weight = cost[order], weight[order]
+    filled = np.cumsum(cost)
+    fits = np.searchsorted(filled, budget.using, side='right')
+    per_slot = weight[:fits].sum()
+    if fits < len(cost):
+        left = budget.using - (filled[fits - 1] if fits else 0.)
+        per_slot += weight[fits] * left / cost[fits]
+    return float(budget.max_slots * (per_slot + free_weight))
+
+
+def _mean(values):
+    return float(values.mean()) if len(values) else 0.
+
+
+def _stdev(values):
+    """:return: the sample standard deviation, as utils.mean_stdev"""
+    return float(values.std(ddof=1)) if len(values) > 1 else 0.
+
+
+def perturbed_slots(before, after):
+    """Count the slots whose queries differ between two schedules, i.e. the
+    slots to reconfigure when moving from one to the other
+    :before, after: the schedules, as lists of slots
+    :return: the number of perturbed slots"""
+    queries = list({q for slot in itertools.chain(before, after)
+                    for q in slot})
+    slots = max(len(before), len(after))
+    old = np.zeros((len(queries), slots), dtype=bool)
+    new = np.zeros_like(old)
+    old[:, :len(before)] = Occupancy(before, queries).matrix
+    new[:, :len(after)] = Occupancy(after, queries).matrix
+    return int((old != new).any(axis=0).sum())
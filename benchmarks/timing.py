@@ -0,0 +1,226 @@
+"""
+Instrumentation of the benchmarked calls.
+
+Every call is measured in wall-clock and CPU time, along with the peak RSS of
+the process during the call and, optionally, the number of objects it left
+allocated. Quick calls can be warmed up, looped and sampled to get robust
+times. Named spans can also be timed inside the call, either by wrapping
+functions of the algorithms (--span module:function), or with the span()
+context manager. Every measure is reported in its own CSV column.
+"""
+import contextlib
+import functools
+import gc
+import importlib
+import resource
+import sys
+import time
+
+import numpy as np
+
+# The CSV columns of the measures, besides the wall-clock time which the
+# benchmarks report in their 'time' column
+FIELDS = ['cpu_time', 'peak_rss', 'allocs', 'time_iqr', 'cpu_time_iqr',
+          'loops', 'samples']
+# The measures whose interquartile range is reported
+IQR_FIELDS = ['time', 'cpu_time']
+# The maximal number of calls per timed loop
+MAX_LOOPS = 1000000
+# The measurement parameters of quick calls, see parse_timing
+REPEATED = {'warmup': 1, 'min_duration': .001, 'samples': 5}
+
+try:
+    perf_counter = time.perf_counter
+    process_time = time.process_time
+except AttributeError:
+    # Python 2: time.time is the highest resolution wall clock on Linux, and
+    # getrusage gives the CPU time with a microsecond resolution
+    perf_counter = time.time
+
+    def process_time():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+# The measurement parameters, see setup()
+_COUNT_ALLOCS = False
+_WARMUP = 0
+_MIN_DURATION = 0.
+_SAMPLES = 1
+_GC = 'disabled'
+# The names of the spans that are reported
+_SPANS = []
+# The time spent in every span during the current measure, if any
+_ACTIVE = None
+
+
+def parse_timing(parser):
+    timing = parser.add_argument_group('Instrumentation')
+    timing.add_argument('--span', help='Report the time spent in a function '
+                        'of the algorithms (module:function), or in a span '
+                        'defined by the algorithms (name), in the '
+                        'span_<name> column', action='append', default=[],
+                        metavar='SPAN')
+    timing.add_argument('--count-allocs', help='Report the number of objects '
+                        'left allocated by the timed calls, which walks the '
+                        'heap before and after them', action='store_true',
+                        default=False)
+    timing.add_argument('--warmup', help='The number of untimed calls before '
+                        'the measures', type=int, default=0)
+    timing.add_argument('--min-duration', help='Loop over the call until a '
+                        'loop lasts this many seconds, and report the time '
+                        'per call', type=float, default=0.)
+    timing.add_argument('--samples', help='The number of timed loops, whose '
+                        'median and interquartile range are reported',
+                        type=int, default=1)
+    timing.add_argument('--gc', help='Collect the garbage then disable the '
+                        'gc while measuring, or leave it enabled',
+                        choices=['disabled', 'enabled'], default='disabled')
+
+
+def setup(args):
+    """Instrument the algorithms and set the measurement parameters as
+    requested on the command line"""
+    global _COUNT_ALLOCS, _WARMUP, _MIN_DURATION, _SAMPLES, _GC
+    _COUNT_ALLOCS = args.count_allocs
+    _WARMUP = args.warmup
+    _MIN_DURATION = args.min_duration
+    _SAMPLES = max(1, args.samples)
+    _GC = args.gc
+    for spec in args.span:
+        instrument(spec)
+
+
+def fields():
+    """:return: the CSV columns of the measures"""
+    return FIELDS + ['span_%s' % name for name in _SPANS]
+
+
+def instrument(spec):
+    """Report the time spent in a span
+    :spec: either module:function, to time the calls to that function made
+           through its module, or the name of a span used by the
+           algorithms"""
+    module, _, name = spec.rpartition(':')
+    if module:
+        module = importlib.import_module(module)
+        func = getattr(module, name)
+
+        @functools.wraps(func)
+        def timed(*args, **kw):
+            with span(name):
+                return func(*args, **kw)
+        setattr(module, name, timed)
+    _SPANS.append(name)
+
+
+@contextlib.contextmanager
+def span(name):
+    """Time a block of code, in the span_<name> column of the current
+    measure, if that span is reported"""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        if _ACTIVE is not None and name in _ACTIVE:
+            _ACTIVE[name] += perf_counter() - start
+
+
+def measure(f, *args, **kw):
+    """Call f(*args, **kw) and measure it.
+
+    The call is first repeated to warm up, then looped until one loop lasts
+    at least the minimal duration. The loop is then timed a number of
+    samples, and the per-call times are reported as their median and
+    interquartile range.
+
+    :return: the result of the last call of f, and the measures by CSV
+             column, the wall-clock time being in 'time'"""
+    gc_was_enabled = gc.isenabled()
+    if _GC == 'disabled':
+        gc.collect()
+        gc.disable()
+    try:
+        for _ in xrange(_WARMUP):
+            f(*args, **kw)
+        _reset_peak_rss()
+        allocs = _allocated() if _COUNT_ALLOCS else None
+        loops = 1
+        while True:
+            res, sample = _time_loop(f, loops, args, kw)
+            elapsed = sample[0] * loops
+            if elapsed >= _MIN_DURATION or loops >= MAX_LOOPS:
+                break
+            # Aim past the minimal duration, with at most 10 times more loops
+            loops = min(MAX_LOOPS, int(loops * min(
+                10., 1.2 * _MIN_DURATION / max(elapsed, 1e-9))) + 1)
+        samples = [sample]
+        for _ in xrange(_SAMPLES - 1):
+            res, sample = _time_loop(f, loops, args, kw)
+            samples.append(sample)
+        peak_rss = _peak_rss()
+        if allocs is not None:
+            allocs = _allocated() - allocs
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    measures = {'peak_rss': peak_rss, 'loops': loops,
+                'samples': len(samples)}
+    if allocs is not None:
+        measures['allocs'] = allocs
+    names = ['time', 'cpu_time'] + ['span_%s' % name for name in _SPANS]
+    for name, values in zip(names, zip(*samples)):
+        q1, median, q3 = np.percentile(values, [25, 50, 75])
+        measures[name] = median
+        if name in IQR_FIELDS:
+            measures['%s_iqr' % name] = q3 - q1
+    return res, measures
+
+
+def _time_loop(f, loops, args, kw):
+    """Call f(*args, **kw) loops times
+    :return: the result of the last call, and the wall-clock time, CPU time
+             and time in every span, per call"""
+    global _ACTIVE
+    _ACTIVE = dict.fromkeys(_SPANS, 0.)
+    try:
+        cpu = -process_time()
+        wall = -perf_counter()
+        for _ in xrange(loops):
+            res = f(*args, **kw)
+        wall += perf_counter()
+        cpu += process_time()
+        spans = _ACTIVE
+    finally:
+        _ACTIVE = None
+    return res, ([wall / loops, cpu / loops] +
+                 [spans[name] / loops for name in _SPANS])
+
+
+def _allocated():
+    """:return: the number of allocated memory blocks, or of objects tracked
+                by the gc if that is not available"""
+    try:
+        return sys.getallocatedblocks()
+    except AttributeError:
+        return len(gc.get_objects())
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS of the process, if supported (Linux >= 4.0)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def _peak_rss():
+    """:return: the peak RSS of the process, in kB"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -1,14 +1,31 @@
+import cPickle as pickle
+import hashlib
 import logging
+import os
 import random
+import tempfile
 
 import networkx as nx
 
+from .features import TopologyFeatures
+from .spt import CompactSPT
+
 
 LOG = logging.getLogger(__name__)
 
+# The default directory where the sanitized graphs are cached
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '.cache')
+# Bump this whenever sanitize_graph changes to invalidate the cache
+CACHE_VERSION = 3
+# The ratio of nodes registered as egresses when sanitizing a graph
+EGRESS_RATIO = .3
+
 
-def sanitize_graph(g):
-    """Make sure that g can be used for benchmarking."""
+def sanitize_graph(g, compact_spt=False):
+    """Make sure that g can be used for benchmarking, and characterize it
+    (see TopologyFeatures).
+    :compact_spt: store the shortest paths in a CompactSPT rather than
+                  building them all with NetGraph.build_spt"""
     LOG.debug('Sanitizing %s (%d nodes, %d edges)', g.name,
               g.number_of_nodes(), g.number_of_edges())
     g.remove_edges_from(g.selfloop_edges())
@@ -18,11 +35,14 @@ def sanitize_graph(g):
     g.remove_nodes_from(set(g.nodes_iter()).difference(connected_component))
     LOG.debug('Kept only the largest strongly connected component: '
               '%d nodes, %d edges', g.number_of_nodes(), g.number_of_edges())
-    g.build_spt()
-    g.net_diameter = max(len(p[0])
-                         for s, d in g.spt.iteritems()
-                         for p in d.itervalues())
-    egresses = random.sample(g.nodes(), int(len(g) * .3))
+    if compact_spt:
+        g.spt = CompactSPT(g)
+    else:
+        g.build_spt()
+    g.features = TopologyFeatures(g)
+    g.net_diameter = g.features.diameter
+    LOG.debug('Features of %s: %s', g.name, g.features.summary())
+    egresses = random.sample(g.nodes(), int(len(g) * EGRESS_RATIO))
     LOG.debug('Registering egresses: %s', egresses)
     for e in egresses:
         g.register_egress(e)
@@ -32,3 +52,59 @@ def sanitize_graph(g):
              g.number_of_edges(),
              g.net_diameter)
     return g
+
+
+def cached_graph(filename, build, cache_dir=None, params=()):
+    """Return a sanitized graph, loading it from the cache if possible.
+
+    The cache entries are keyed by the content of the topology file, the
+    sanitization parameters and the state of the random generator, as
+    sanitize_graph uses it. Loading a graph from the cache also restores the
+    state of the random generator as it was after building that graph.
+    :filename: the topology file
+    :build: a function building the sanitized graph from that file
+    :cache_dir: the cache directory, None to disable the cache
+    :params: the other parameters of build that change the graph"""
+    if not cache_dir:
+        g = build()
+        if g is None:
+            return g
+        # Unpickling can change the iteration order of the nodes and edges,
+        # return the graph exactly as it would be loaded from the cache
+        return pickle.loads(pickle.dumps(g, pickle.HIGHEST_PROTOCOL))
+    key = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        key.update(f.read())
+    key.update(repr((CACHE_VERSION, EGRESS_RATIO, params,
+                     random.getstate())))
+    path = os.path.join(cache_dir, '%s.%s.pickle' % (
+        os.path.basename(filename), key.hexdigest()))
+    try:
+        with open(path, 'rb') as f:
+            g, state = pickle.load(f)
+        random.setstate(state)
+        LOG.info('Loaded graph for %s (%d nodes, %d edges, diameter: %d) '
+                 'from %s', g.name, g.number_of_nodes(), g.number_of_edges(),
+                 g.net_diameter, path)
+        return g
+    except (IOError, OSError, EOFError, pickle.UnpicklingError) as e:
+        LOG.debug('Cache miss for %s: %s', filename, e)
+    g = build()
+    if g is None:
+        return g
+    data = pickle.dumps((g, random.getstate()), pickle.HIGHEST_PROTOCOL)
+    # Return the graph as it will be loaded from the cache, as unpickling
+    # can change the iteration order of its nodes and edges
+    g, _ = pickle.loads(data)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Write then rename, to never expose partial entries
+        fd, tmp = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+        LOG.debug('Cached %s in %s', g.name, path)
+    except (IOError, OSError) as e:
+        LOG.warning('Could not cache %s in %s: %s', g.name, cache_dir, e)
+    return g
@@ -0,0 +1,116 @@
+"""
+Characterize the topologies used in the benchmarks.
+
+All statistics are derived from the all-pairs distance matrix. The shortest
+path DAG towards every destination is then walked for all destinations at
+once, with array operations over the edges of the graph, rather than by
+enumerating the shortest paths.
+"""
+import numpy as np
+
+from .spt import (COST_KEY, UNREACHABLE, CompactSPT, distance_matrix,
+                  spt_distance_matrix)
+
+# The CSV columns reported by TopologyFeatures.summary()
+FIELDS = ['nodes', 'edges', 'diameter', 'avg_hops', 'avg_degree',
+          'max_degree', 'ecmp_ratio', 'max_ecmp']
+
+
+class TopologyFeatures(object):
+    """The structural features of a graph, which are stored with it.
+
+    The histograms are arrays indexed by value, e.g. hop_count[h] is the
+    number of pairs of distinct nodes whose longest shortest path has h hops,
+    and ecmp[k] the number of those that have k shortest paths."""
+
+    def __init__(self, g, weight=COST_KEY):
+        """:g: the graph, whose shortest path distances are derived from its
+              spt if it has been built
+        :weight: the edge attribute holding the link costs"""
+        if isinstance(g.spt, CompactSPT):
+            nodes, dist = g.spt.nodes, g.spt.dist
+        elif g.spt:
+            nodes = g.nodes()
+            dist = spt_distance_matrix(g, nodes, weight)
+        else:
+            nodes = g.nodes()
+            dist = distance_matrix(g, nodes, weight)
+        index = {n: i for i, n in enumerate(nodes)}
+        src, dst, cost = _edge_arrays(g, index, weight)
+        hops, ecmp = _walk_spt(dist, src, dst, cost)
+        pairs = dist > 0
+        self.nodes = len(nodes)
+        self.edges = len(src)
+        self.hop_count = np.bincount(hops[pairs])
+        self.ecmp = np.bincount(ecmp[pairs])
+        self.degree = np.bincount(np.bincount(src, minlength=len(nodes)))
+        # The number of nodes on the longest shortest path
+        self.diameter = len(self.hop_count)
+
+    def summary(self):
+        """:return: the scalar features of the graph, by CSV column (see
+                    FIELDS)"""
+        pairs = float(self.hop_count.sum()) or 1.
+        return {'nodes': self.nodes,
+                'edges': self.edges,
+                'diameter': self.diameter,
+                'avg_hops': _weighted_sum(self.hop_count) / pairs,
+                'avg_degree': _weighted_sum(self.degree) / float(self.nodes),
+                'max_degree': len(self.degree) - 1,
+                'ecmp_ratio': self.ecmp[2:].sum() / pairs,
+                'max_ecmp': len(self.ecmp) - 1}
+
+
+def _weighted_sum(histogram):
+    """:return: the sum of the values counted in the histogram"""
+    return np.dot(np.arange(len(histogram)), histogram)
+
+
+def _edge_arrays(g, index, weight):
+    """:return: the source, destination and cost of every edge, sorted by
+                source"""
+    edges = np.array([(index[u], index[v], int(d.get(weight, 1)))
+                      for u, v, d in g.edges_iter(data=True)],
+                     dtype=np.int64).reshape(-1, 3)
+    edges = edges[np.argsort(edges[:, 0], kind='mergesort')]
+    return edges[:, 0], edges[:, 1], edges[:, 2]
+
+
+def _walk_spt(dist, src, dst, cost):
+    """Compute the number of hops and of shortest paths between all nodes.
+
+    Edge e lies on a shortest path towards d iff
+    dist[src[e], d] == cost[e] + dist[dst[e], d], which gives the shortest
+    path DAG of every destination as one boolean matrix (edges x nodes).
+    Both values are then propagated along these DAGs, one hop further at
+    every iteration, until they no longer change.
+
+    :dist: the distance matrix
+    :src, dst, cost: the edges, sorted by source
+    :return: the matrices of the largest number of hops of the shortest
+             paths, and of the number of shortest paths, between every pair
+             of nodes"""
+    n = len(dist)
+    on_spt = ((dist[src] == cost[:, None] + dist[dst]) &
+              (dist[dst] != UNREACHABLE))
+    # The first edge of every node, to aggregate the edges per source
+    heads, starts = np.unique(src, return_index=True)
+    hops = np.zeros((n, n), dtype=np.int64)
+    ecmp = np.identity(n, dtype=np.int64)
+    if not len(src):
+        return hops, ecmp
+    diagonal = np.identity(n, dtype=bool)
+    for _ in xrange(n):
+        next_hops = np.zeros_like(hops)
+        next_hops[heads] = np.maximum.reduceat(
+            np.where(on_spt, hops[dst] + 1, 0), starts)
+        next_ecmp = np.zeros_like(ecmp)
+        next_ecmp[heads] = np.add.reduceat(
+            np.where(on_spt, ecmp[dst], 0), starts)
+        next_hops[diagonal] = 0
+        next_ecmp[diagonal] = 1
+        if (np.array_equal(next_hops, hops) and
+                np.array_equal(next_ecmp, ecmp)):
+            break
+        hops, ecmp = next_hops, next_ecmp
+    return hops, ecmp
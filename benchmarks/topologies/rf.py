@@ -1,33 +1,57 @@
+import itertools
 import os
 import logging
 
 from stroboscope.network_database import NetGraph
 
-from . import sanitize_graph
+from . import sanitize_graph, cached_graph
 
 LOG = logging.getLogger(__name__)
 
 
-def get_topo(name):
-    """Return the network graph for the named topology"""
-    filename = os.path.join(os.path.dirname(__file__),
-                            'rocketfuel',
-                            'as%s' % name)
-    LOG.debug('Reading graph from %s', filename)
-    g = NetGraph()
-    g.name = name
+def _filename(name):
+    return os.path.join(os.path.dirname(__file__), 'rocketfuel', 'as%s' % name)
+
+
+def get_size(name):
+    """Return the number of nodes of the named topology, before it gets
+    sanitized, without building its graph"""
     try:
-        with open(filename, 'r') as f:
-            for line in f.readlines():
-                u, v, c = _to_weighted_edge(line)
-                g.register_link(u, v, cost=c)
+        with open(_filename(name), 'r') as f:
+            return len(set(itertools.chain.from_iterable(
+                _to_weighted_edge(line)[:2] for line in f)))
     except IOError as e:
         LOG.error('Could not open the rocketfuel topology for AS %s: %s',
                   name, e)
         return None
+
+
+def get_topo(name, cache_dir=None, compact_spt=False):
+    """Return the network graph for the named topology
+    :cache_dir: the directory where sanitized graphs are cached, if any
+    :compact_spt: see sanitize_graph"""
+    filename = _filename(name)
+    try:
+        return cached_graph(filename,
+                            lambda: _build(name, filename, compact_spt),
+                            cache_dir, params=(compact_spt,))
+    except IOError as e:
+        LOG.error('Could not open the rocketfuel topology for AS %s: %s',
+                  name, e)
+        return None
+
+
+def _build(name, filename, compact_spt):
+    LOG.debug('Reading graph from %s', filename)
+    g = NetGraph()
+    g.name = name
+    with open(filename, 'r') as f:
+        for line in f.readlines():
+            u, v, c = _to_weighted_edge(line)
+            g.register_link(u, v, cost=c)
     for n in g:
         g.register_router(n)
-    return sanitize_graph(g)
+    return sanitize_graph(g, compact_spt=compact_spt)
 
 
 def _to_weighted_edge(x):
@@ -0,0 +1,142 @@
+"""
+A compact store for the all-pairs shortest paths of a graph.
+
+NetGraph.build_spt keeps every shortest path of every pair of nodes, i.e.
+O(n^2 * diameter) python objects, which does not fit in memory for the
+largest topologies. CompactSPT only keeps the matrix of the shortest path
+distances, and rebuilds the paths of a pair when they are requested, by
+following the next hops that lie on a shortest path to the destination.
+"""
+import itertools
+
+import networkx as nx
+import numpy as np
+
+# The edge attribute holding the IGP cost of the links
+COST_KEY = 'cost'
+# The distance between two nodes that are not connected
+UNREACHABLE = -1
+
+
+def distance_matrix(g, nodes, weight=COST_KEY):
+    """Compute the shortest path distances between all nodes of a graph
+    :g: the graph
+    :nodes: the nodes of g, in the order of the rows of the matrix
+    :weight: the edge attribute holding the link costs
+    :return: the distance matrix, UNREACHABLE if there is no path"""
+    index = {n: i for i, n in enumerate(nodes)}
+    dist = np.full((len(nodes), len(nodes)), UNREACHABLE, dtype=np.int32)
+    for i, src in enumerate(nodes):
+        for dst, cost in nx.single_source_dijkstra_path_length(
+                g, src, weight=weight).iteritems():
+            dist[i, index[dst]] = cost
+    return dist
+
+
+def spt_distance_matrix(g, nodes, weight=COST_KEY):
+    """Derive the shortest path distances between all nodes of a graph from
+    the paths built by NetGraph.build_spt, rather than computing them again
+    :g: the graph, with its spt built
+    :nodes: the nodes of g, in the order of the rows of the matrix
+    :weight: the edge attribute holding the link costs
+    :return: the distance matrix, UNREACHABLE if there is no path"""
+    index = {n: i for i, n in enumerate(nodes)}
+    dist = np.full((len(nodes), len(nodes)), UNREACHABLE, dtype=np.int32)
+    for i, src in enumerate(nodes):
+        for dst, paths in g.spt[src].iteritems():
+            if not paths:
+                continue
+            path = paths[0]
+            dist[i, index[dst]] = sum(int(g[u][v].get(weight, 1))
+                                      for u, v in itertools.izip(path,
+                                                                 path[1:]))
+    return dist
+
+
+class CompactSPT(object):
+    """The all-pairs shortest paths of a graph, indexed as NetGraph.spt, i.e.
+    spt[src][dst] is the list of the shortest paths from src to dst.
+
+    The IGP costs are expected to be positive integers."""
+
+    def __init__(self, g, weight=COST_KEY):
+        """:g: the graph, which must not be modified afterwards
+        :weight: the edge attribute holding the link costs"""
+        self.nodes = g.nodes()
+        self.index = {n: i for i, n in enumerate(self.nodes)}
+        # succ[i] is the list of (neighbor index, cost) of node i
+        self.succ = [[(self.index[v], int(d.get(weight, 1)))
+                      for v, d in g[u].iteritems()]
+                     for u in self.nodes]
+        self.dist = distance_matrix(g, self.nodes, weight)
+
+    def __getitem__(self, src):
+        return _SPTRow(self, self.index[src])
+
+    def __contains__(self, src):
+        return src in self.index
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def iteritems(self):
+        for i, src in enumerate(self.nodes):
+            yield src, _SPTRow(self, i)
+
+    def itervalues(self):
+        for i in xrange(len(self.nodes)):
+            yield _SPTRow(self, i)
+
+    def paths(self, src, dst):
+        """Rebuild the shortest paths between two nodes
+        :src: the index of the source node
+        :dst: the index of the destination node
+        :return: the list of shortest paths, as lists of nodes"""
+        dist = self.dist
+        if dist.item(src, dst) == UNREACHABLE:
+            return []
+        paths = []
+        # Depth-first walk along the next hops towards dst
+        stack = [(src, [self.nodes[src]])]
+        while stack:
+            u, path = stack.pop()
+            if u == dst:
+                paths.append(path)
+                continue
+            remaining = dist.item(u, dst)
+            # Push in reverse order to yield the paths in neighbor order
+            for v, cost in reversed(self.succ[u]):
+                if dist.item(v, dst) == remaining - cost:
+                    stack.append((v, path + [self.nodes[v]]))
+        return paths
+
+
+class _SPTRow(object):
+    """The shortest paths from a given source, indexed by destination"""
+
+    def __init__(self, spt, src):
+        self.spt = spt
+        self.src = src
+
+    def __getitem__(self, dst):
+        return self.spt.paths(self.src, self.spt.index[dst])
+
+    def __contains__(self, dst):
+        return dst in self.spt.index
+
+    def __iter__(self):
+        return iter(self.spt.nodes)
+
+    def __len__(self):
+        return len(self.spt.nodes)
+
+    def iteritems(self):
+        for i, dst in enumerate(self.spt.nodes):
+            yield dst, self.spt.paths(self.src, i)
+
+    def itervalues(self):
+        for i in xrange(len(self.spt.nodes)):
+            yield self.spt.paths(self.src, i)
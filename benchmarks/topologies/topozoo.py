@@ -4,16 +4,34 @@ import os
 import networkx as nx
 
 from stroboscope.network_database import NetGraph
-from . import sanitize_graph
+from . import sanitize_graph, cached_graph
 
 LOG = logging.getLogger(__name__)
 
 
-def get_topo(name):
-    """Return the network graph for the named topology"""
-    filename = os.path.join(os.path.dirname(__file__),
-                            'topologyzoo',
-                            '%s.gml' % name)
+def _filename(name):
+    return os.path.join(os.path.dirname(__file__), 'topologyzoo',
+                        '%s.gml' % name)
+
+
+def get_size(name):
+    """Return the number of nodes of the named topology, before it gets
+    sanitized, without building its graph"""
+    with open(_filename(name), 'r') as f:
+        return sum(1 for line in f if line.strip() == 'node [')
+
+
+def get_topo(name, cache_dir=None, compact_spt=False):
+    """Return the network graph for the named topology
+    :cache_dir: the directory where sanitized graphs are cached, if any
+    :compact_spt: see sanitize_graph"""
+    filename = _filename(name)
+    return cached_graph(filename,
+                        lambda: _build(name, filename, compact_spt),
+                        cache_dir, params=(compact_spt,))
+
+
+def _build(name, filename, compact_spt):
     logging.debug('Reading graph from %s', filename)
     content = nx.read_gml(filename, label='id')
     g = NetGraph()
@@ -22,4 +40,4 @@ def get_topo(name):
         g.register_router(n)
     for u, v in content.edges_iter():
         g.register_link(u, v)
-    return sanitize_graph(g)
+    return sanitize_graph(g, compact_spt=compact_spt)
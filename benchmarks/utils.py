@@ -1,6 +1,7 @@
 
 """General purpose functions"""
 import math
+import random
 
 
 def mean_stdev(data):
@@ -14,3 +15,56 @@ def mean_stdev(data):
     mean = sum(data) / ldata
     return mean, (math.sqrt(sum((x - mean) ** 2 for x in data) / (ldata - 1))
                   if ldata > 1 else 0)
+
+
+class IndexedSet(object):
+    """A set supporting the insertion, removal and random selection of its
+    items in constant time. The items are kept in a list, removing an item
+    moves the last one in its slot."""
+
+    def __init__(self, items=()):
+        self.items = []
+        self.pos = {}
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.pos
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def copy(self):
+        other = IndexedSet()
+        other.items = self.items[:]
+        other.pos = self.pos.copy()
+        return other
+
+    def add(self, item):
+        if item not in self.pos:
+            self.pos[item] = len(self.items)
+            self.items.append(item)
+
+    def remove(self, item):
+        """:raise: KeyError if item is not in the set"""
+        idx = self.pos.pop(item)
+        last = self.items.pop()
+        if idx < len(self.items):
+            self.items[idx] = last
+            self.pos[last] = idx
+
+    def pop_random(self):
+        """Remove and return a random item
+        :raise: IndexError if the set is empty"""
+        items = self.items
+        idx = int(random.random() * len(items))
+        item = items[idx]
+        last = items.pop()
+        if idx < len(items):
+            items[idx] = last
+            self.pos[last] = idx
+        del self.pos[item]
+        return item
@@ -0,0 +1,151 @@
+"""
+Workload files, holding the egresses and paths used by the benchmarks.
+
+A workload file starts with MAGIC, followed by one entry per work unit, i.e.
+per (graph, repetition), then by a JSON index, and ends with the offset of
+that index. The index lists the generation parameters and the offset of
+every entry.
+
+An entry starts with the JSON list of the nodes that it uses, as every node
+is then referenced by its position in that list. It is followed by the
+number of egresses and their nodes, then by the number of paths, and by
+every path as its length and its nodes. All integers are unsigned 32 bits,
+in network byte order.
+"""
+import array
+import json
+import struct
+import sys
+
+MAGIC = 'STRBWL01'
+# The command line arguments that define a workload
+PARAMS = ['zoo', 'rocketfuel', 'repeat', 'seed', 'max_path', 'max_len',
+          'path_perturb', 'egress_percentage', 'egress_degree',
+          'region_count', 'egress_selection', 'path_selection',
+          'path_samples', 'path_budget', 'pair_order']
+
+_COUNT = struct.Struct('>I')
+_OFFSET = struct.Struct('>Q')
+
+
+class WorkloadWriter(object):
+    """Write the work units of a workload file, in any order"""
+
+    def __init__(self, f, args):
+        """:f: the file where the workload is written
+        :args: the parsed command line arguments, see PARAMS"""
+        self.f = f
+        self.params = {p: getattr(args, p) for p in PARAMS}
+        self.units = []
+        self.regions = False
+        f.write(MAGIC)
+
+    def add(self, graph, repeat, egresses, paths):
+        """Write a work unit
+        :graph: the name of its graph
+        :repeat: its repetition
+        :egresses: its egresses
+        :paths: its paths, or regions if they are sets"""
+        nodes = []
+        index = {}
+
+        def ids(seq):
+            for n in seq:
+                if n not in index:
+                    index[n] = len(nodes)
+                    nodes.append(n)
+            return _pack_ids(index[n] for n in seq)
+
+        chunks = [ids(egresses)]
+        for p in paths:
+            if isinstance(p, (set, frozenset)):
+                self.regions = True
+            chunks.append(ids(p))
+        self.units.append((graph, repeat, self.f.tell()))
+        _write_chunk(self.f, json.dumps(nodes))
+        self.f.write(chunks[0])
+        self.f.write(_COUNT.pack(len(chunks) - 1))
+        for chunk in chunks[1:]:
+            self.f.write(chunk)
+
+    def close(self):
+        """Write the index of the workload"""
+        offset = self.f.tell()
+        _write_chunk(self.f, json.dumps({'params': self.params,
+                                         'regions': self.regions,
+                                         'units': self.units}))
+        self.f.write(_OFFSET.pack(offset))
+
+
+class Workload(object):
+    """A workload file, whose work units are read on demand"""
+
+    def __init__(self, filename):
+        """:filename: the workload file name
+        :raise: ValueError if this is not a workload file"""
+        self.filename = filename
+        self.f = None
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is not a workload file' % filename)
+            f.seek(-_OFFSET.size, 2)
+            offset, = _OFFSET.unpack(f.read(_OFFSET.size))
+            f.seek(offset)
+            index = json.loads(_read_chunk(f))
+        self.params = index['params']
+        self.regions = index['regions']
+        self.units = {(g, r): o for g, r, o in index['units']}
+
+    def __contains__(self, unit):
+        return unit in self.units
+
+    def load(self, graph, repeat):
+        """Read a work unit
+        :graph: the name of its graph
+        :repeat: its repetition
+        :return: its egresses, and an iterator over its paths, which reads
+                 them from the file as it goes
+        :raise: KeyError if the workload does not have that unit"""
+        offset = self.units[graph, repeat]
+        if self.f is None:
+            # Opened lazily, in the process that reads the units
+            self.f = open(self.filename, 'rb')
+        self.f.seek(offset)
+        nodes = [n.encode('utf-8') if isinstance(n, unicode) else n
+                 for n in json.loads(_read_chunk(self.f))]
+        egresses = [nodes[i] for i in _read_ids(self.f)]
+        count, = _COUNT.unpack(self.f.read(_COUNT.size))
+        return egresses, self._paths(self.f.tell(), nodes, count)
+
+    def _paths(self, pos, nodes, count):
+        for _ in xrange(count):
+            # Other units could have been read in between
+            self.f.seek(pos)
+            path = [nodes[i] for i in _read_ids(self.f)]
+            pos = self.f.tell()
+            yield set(path) if self.regions else path
+
+
+def _pack_ids(ids):
+    ids = array.array('I', ids)
+    if sys.byteorder == 'little':
+        ids.byteswap()
+    return _COUNT.pack(len(ids)) + ids.tostring()
+
+
+def _read_ids(f):
+    count, = _COUNT.unpack(f.read(_COUNT.size))
+    ids = array.array('I', f.read(4 * count))
+    if sys.byteorder == 'little':
+        ids.byteswap()
+    return ids
+
+
+def _write_chunk(f, data):
+    f.write(_COUNT.pack(len(data)))
+    f.write(data)
+
+
+def _read_chunk(f):
+    size, = _COUNT.unpack(f.read(_COUNT.size))
+    return f.read(size)
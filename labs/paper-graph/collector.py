@@ -1,8 +1,18 @@
 #!/bin/python2
 """Entry point to start a Stroboscope collector."""
 import argparse
+import array
+import collections
+import functools
+import ipaddress
+import json
 import logging
 import itertools
+import multiprocessing
+import random
+import time
+
+import numpy as np
 
 from stroboscope import join
 from stroboscope.collector import Collector
@@ -15,77 +25,764 @@ logging.basicConfig(level=logging.DEBUG)
 LOG = logging.getLogger(__name__)
 
 
-class Analyzer(MeasurementProcessor):
-    """
-    Compute loss rates and load-balancing occurences for all MIRROR queries.
-    """
+def index_slice(packets):
+    """Index the packets mirrored at a location by their identity.
 
-    def process(self, locations, queries, traffic_slices):
+    :packets: the list of packets mirrored at that location
+    :return: a dict mapping every packet to its first mirrored copy, i.e.
+             the copy that list.index() would have found (see the __eq__ and
+             __hash__ overloads)"""
+    index = {}
+    for pkt in packets:
+        index.setdefault(pkt, pkt)
+    return index
+
+
+QueryStats = collections.namedtuple(
+    'QueryStats', ['entered', 'exited', 'lost', 'load_balanced'])
+
+
+# The possible outcomes for a packet entering a MIRROR query
+EXITED, LOST, LOAD_BALANCED = range(3)
+
+
+class TTLMismatches(object):
+    """Aggregate the TTL mismatches observed during a slice, rather than
+    logging every single one of them.
+
+    Mismatches are counted per (query, previous location, location,
+    expected decrease, observed decrease), and a few exemplar packets are
+    sampled for each of these."""
+
+    def __init__(self, exemplars=3):
+        """:exemplars: the maximal number of exemplars kept per mismatch"""
+        self.exemplars = exemplars
+        self.counts = collections.Counter()
+        self.samples = collections.defaultdict(list)
+
+    def add(self, q, prev_loc, loc, expected, observed, pkt, count=1):
+        """Register mismatching packets.
+
+        :q: the query where the mismatch occured
+        :prev_loc: the location where the packets were last seen
+        :loc: the location where the TTL decrease did not match
+        :expected: the expected TTL decrease
+        :observed: the observed TTL decrease
+        :pkt: an exemplar of these packets
+        :count: the number of mismatching packets"""
+        key = (q.name, str(prev_loc), str(loc), int(expected), int(observed))
+        self.counts[key] += count
+        # Reservoir sampling, keep every packet with the same probability
+        samples = self.samples[key]
+        if len(samples) < self.exemplars:
+            samples.append(str(pkt))
+        else:
+            i = random.randrange(self.counts[key])
+            if i < self.exemplars:
+                samples[i] = str(pkt)
+
+    def merge(self, other):
+        """Add the mismatches registered in another TTLMismatches."""
+        for key, count in other.counts.iteritems():
+            self.counts[key] += count
+            samples = self.samples[key]
+            samples.extend(other.samples[key])
+            if len(samples) > self.exemplars:
+                samples[:] = random.sample(samples, self.exemplars)
+
+    def emit(self, sink=None):
+        """Log one warning per kind of mismatch, and reset the counters.
+
+        :sink: a file where a JSON record is written for every kind of
+               mismatch, one per line"""
+        ts = time.time()
+        for key, count in self.counts.most_common():
+            name, prev_loc, loc, expected, observed = key
+            samples = self.samples[key]
+            LOG.warning('TTL mismatch for %s: %d packets saw a decrease of %d '
+                        'from %s to %s (expected %d), e.g. %s', name, count,
+                        observed, prev_loc, loc, expected, ', '.join(samples))
+            if sink is not None:
+                sink.write(json.dumps({
+                    'time': ts, 'query': name, 'from': prev_loc, 'to': loc,
+                    'expected': expected, 'observed': observed,
+                    'count': count, 'exemplars': samples}))
+                sink.write('\n')
+        self.counts.clear()
+        self.samples.clear()
+
+
+def follow_packet(q, src, dst, pkt, copy_at, mismatches):
+    """Follow a packet along the locations of a MIRROR query, checking that
+    its TTL decreases as expected.
+
+    :q: the query
+    :src: the location where pkt entered the query
+    :dst: the location where pkt should exit the query
+    :pkt: the packet mirrored at src
+    :copy_at: a function returning the copy of pkt mirrored at a location,
+              or None if it was not seen there
+    :mismatches: the TTLMismatches registering the TTL mismatches
+    :return: the outcome for the packet, and a dict mapping every location
+             but src to the copy seen there (or None)"""
+    seen = {}  # record the location where a packet has been seen
+    prev_ttl = pkt.ttl
+    prev_loc = src
+    for loc, dist in q.locations:
+        if loc == src:
+            continue
+        # Get the copy (see the __eq__ overload)
+        copy = copy_at(loc)
+        if copy is None:
+            seen[loc] = None
+            continue
+        # Check TTL condition
+        decrease = prev_ttl - copy.ttl
+        if decrease != dist:
+            mismatches.add(q, prev_loc, loc, dist, decrease, copy)
+        prev_ttl = copy.ttl
+        prev_loc = loc
+        # register the match
+        seen[loc] = copy
+    if seen[dst] is None:
+        return LOST, seen
+    # Packet seen at both ends
+    if len(seen) + 1 < len(q.locations):
+        return LOAD_BALANCED, seen  # Disappeared then reappeared
+    return EXITED, seen
+
+
+def _query_stats(entered, outcomes):
+    """Build the statistics of a query.
+
+    :entered: the number of distinct packets that entered the query
+    :outcomes: a list counting every outcome"""
+    lost = outcomes[LOST]
+    load_balanced = outcomes[LOAD_BALANCED]
+    return QueryStats(entered=entered,
+                      exited=entered - lost - load_balanced,
+                      lost=lost, load_balanced=load_balanced)
+
+
+def analyze_query(q, traffic_slices, indexes, mismatches, selected=None):
+    """Compute the statistics of a MIRROR query over a slice.
+
+    :q: the query to analyze
+    :traffic_slices: the packets mirrored at every location
+    :indexes: the per-location packet indexes (see index_slice)
+    :mismatches: the TTLMismatches registering the TTL mismatches
+    :selected: the packets mirrored at the query source whose destination
+               is in its prefix (see classify_packets), if already known
+    :return: a QueryStats instance, or None if q is not a MIRROR query"""
+    try:
+        src, dst = q.path_endpoints()
+    except AttributeError:
+        return None  # This is a confine query
+    if selected is None:
+        # Check that their DA fits the query prefix
+        selected = (pkt for pkt in traffic_slices[src]
+                    if pkt.dst in q.prefix)
+    matches = {}  # Record matches for the query
+    outcomes = [0, 0, 0]
+    for pkt in selected:
+        # We have a packet for this query, find all matching locations
+        outcome, matches[pkt] = follow_packet(
+            q, src, dst, pkt, lambda loc: indexes.get(loc, {}).get(pkt),
+            mismatches)
+        outcomes[outcome] += 1
+    return _query_stats(len(matches), outcomes)
+
+
+class IncrementalAnalyzer(object):
+    """Compute the statistics of the MIRROR queries of a slice while their
+    packets are being received, instead of once the slice is complete.
+
+    Only the packets that have not yet been seen at every location of a query
+    are kept in memory. These are resolved as lost, or load-balanced, once
+    they expire, i.e. when they have been pending for longer than a timeout,
+    or when they are the oldest pending packet and the window is full. The
+    pending packets of every query are swept once per timeout, so that those
+    of the queries that no longer receive packets expire as well.
+    The most recently resolved packets are also remembered, so that their
+    late duplicate copies are counted as analyze_query() does, rather than
+    entering the query again. Peak memory is thus bounded by the window
+    sizes, whatever the slice length, and the statistics are ready as soon
+    as the slice closes.
+
+    Typical usage:
+        a = IncrementalAnalyzer(queries)
+        for loc, pkt in received_packets:
+            a.add(loc, pkt)
+        stats = a.close()
+        a.mismatches.emit()"""
+
+    def __init__(self, queries, timeout=.1, max_pending=10000,
+                 max_resolved=10000, exemplars=3):
+        """:queries: the queries active during the slice
+        :timeout: the time (in seconds) after which a packet that has not been
+                  seen at every location of a query is expired
+        :max_pending: the maximal number of pending packets per query
+        :max_resolved: the number of resolved packets remembered per query
+                       to recognize their duplicates
+        :exemplars: the number of exemplars kept per TTL mismatch"""
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.mismatches = TTLMismatches(exemplars=exemplars)
+        self.queries = []
         for q in queries:
-            lost = 0
-            load_balanced = 0
             try:
                 src, dst = q.path_endpoints()
             except AttributeError:
                 continue  # This is a confine query
-            matches = {}  # Record matches for the query
-            for pkt in traffic_slices[src]:
-                # Check that its DA fits the query prefix
-                if pkt.dst not in q.prefix:
-                    continue
-                seen = {}  # record the location where a packet has been seen
-                # We have a packet for this query, find all matching locations
-                prev_ttl = pkt.ttl
-                prev_loc = src
-                for loc, dist in q.locations:
-                    if loc == src:
-                        continue
-                    try:
-                        # Get the copy (see the __eq__ overload)
-                        copy = traffic_slices[traffic_slices[loc].index(pkt)]
-                        # Check TTL condition
-                        decrease = prev_ttl - copy.ttl
-                        if decrease != dist:
-                            LOG.warning('TTL mismatch for %s: saw a decrease'
-                                        ' of %d from %d to %d (expected %d)',
-                                        q, decrease, prev_loc, loc, dist)
-                        prev_ttl = copy.ttl
-                        prev_loc = loc
-                        # register the match
-                        seen[loc] = copy
-                    except ValueError:
-                        seen[loc] = None
-                matches[pkt] = seen
-                if seen[dst] is None:
-                    lost += 1
-                else:  # Packet seen at both ends
-                    if len(seen) + 1 < len(q.locations):
-                        load_balanced += 1  # Disappeared then reappeared
+            self.queries.append(_IncrementalQuery(q, src, dst,
+                                                  self.mismatches,
+                                                  max_resolved))
+        # Route the packets mirrored at a location to the relevant queries
+        self._by_loc = collections.defaultdict(list)
+        for iq in self.queries:
+            for loc in iq.locations:
+                self._by_loc[loc].append(iq)
+        self._next_sweep = float('-inf')
+
+    def add(self, loc, pkt, ts=None):
+        """Register a packet mirrored at a given location.
+
+        :loc: the location where the packet was mirrored
+        :pkt: the mirrored packet
+        :ts: the reception timestamp of the packet, defaults to now"""
+        if ts is None:
+            ts = time.time()
+        for iq in self._by_loc.get(loc, ()):
+            if pkt.dst not in iq.q.prefix:
+                continue
+            iq.add(loc, pkt, ts)
+            iq.expire(ts - self.timeout, self.max_pending)
+        if ts >= self._next_sweep:
+            self.expire(ts)
+
+    def expire(self, ts=None):
+        """Expire the pending packets of every query. This is done
+        periodically by add(), but should also be done while no packets are
+        received.
+
+        :ts: the current time, defaults to now"""
+        if ts is None:
+            ts = time.time()
+        self._next_sweep = ts + self.timeout
+        for iq in self.queries:
+            iq.expire(ts - self.timeout, self.max_pending)
+
+    def stats(self):
+        """Return the running statistics of every query, i.e. those of the
+        packets that have been resolved so far.
+
+        :return: a list of (query, QueryStats)"""
+        return [(iq.q, iq.stats()) for iq in self.queries]
+
+    def close(self):
+        """Expire all pending packets as the slice is complete.
+
+        :return: the final list of (query, QueryStats)"""
+        for iq in self.queries:
+            iq.expire(float('inf'), 0)
+        return self.stats()
+
+
+class _IncrementalQuery(object):
+    """The matching state of a query in an IncrementalAnalyzer."""
+
+    def __init__(self, q, src, dst, mismatches, max_resolved=10000):
+        self.q = q
+        self.src = src
+        self.dst = dst
+        self.mismatches = mismatches
+        self.max_resolved = max_resolved
+        self.locations = set(loc for loc, _ in q.locations)
+        self.entered = 0
+        self.outcomes = [0, 0, 0]
+        # pkt -> (first reception time, {loc: first copy}, [copies at src]),
+        # oldest first
+        self.pending = collections.OrderedDict()
+        # pkt -> {loc: first copy}, least recently seen first
+        self.resolved = collections.OrderedDict()
+
+    def add(self, loc, pkt, ts):
+        copies = self.resolved.pop(pkt, None)
+        if copies is not None:
+            self._add_duplicate(loc, pkt, copies)
+            return
+        try:
+            _, copies, sources = self.pending[pkt]
+        except KeyError:
+            copies = {}
+            sources = []
+            self.pending[pkt] = ts, copies, sources
+        copies.setdefault(loc, pkt)
+        if loc == self.src:
+            sources.append(pkt)
+        if len(copies) == len(self.locations):
+            # Seen everywhere, no need to wait
+            self._resolve(pkt)
+
+    def _add_duplicate(self, loc, pkt, copies):
+        """Register a copy of an already resolved packet. As in
+        analyze_query, every copy seen at the source is followed along the
+        first copies seen at the other locations."""
+        if loc == self.src:
+            if self.src not in copies:
+                # Its other copies expired before it entered the query
+                copies[self.src] = pkt
+                self.entered += 1
+            self._follow(pkt, copies)
+        else:
+            copies.setdefault(loc, pkt)
+        self._remember(pkt, copies)
+
+    def expire(self, deadline, max_pending):
+        """Resolve the pending packets received before deadline, as well as
+        the oldest ones in excess of max_pending."""
+        pending = self.pending
+        while pending:
+            pkt, (ts, _, _) = next(pending.iteritems())
+            if ts >= deadline and len(pending) <= max_pending:
+                break
+            self._resolve(pkt)
+
+    def _resolve(self, pkt):
+        _, copies, sources = self.pending.pop(pkt)
+        self._remember(pkt, copies)
+        if not sources:
+            return  # Never entered the query
+        self.entered += 1
+        for src_copy in sources:
+            self._follow(src_copy, copies)
+
+    def _follow(self, src_copy, copies):
+        outcome, _ = follow_packet(self.q, self.src, self.dst, src_copy,
+                                   copies.get, self.mismatches)
+        self.outcomes[outcome] += 1
+
+    def _remember(self, pkt, copies):
+        """Remember a resolved packet, forgetting the least recently seen
+        ones in excess of max_resolved."""
+        resolved = self.resolved
+        resolved[pkt] = copies
+        while len(resolved) > self.max_resolved:
+            resolved.popitem(last=False)
+
+    def stats(self):
+        return _query_stats(self.entered, self.outcomes)
+
+
+def _addr_to_int(addr):
+    """Return the integer value of an IPv4 address."""
+    if isinstance(addr, basestring):
+        addr = ipaddress.ip_address(unicode(addr))
+    return int(addr)
+
+
+def prefix_mask(dst, prefix):
+    """Vectorized version of `pkt.dst in prefix`.
+
+    :dst: an array of IPv4 destination addresses
+    :prefix: an IPv4 network
+    :return: a boolean array telling which addresses belong to prefix"""
+    mask = np.uint32(int(prefix.netmask))
+    return (dst & mask) == np.uint32(int(prefix.network_address))
+
+
+def _prefix_groups(queries):
+    """Group the MIRROR queries by source location, netmask and network.
+
+    :queries: the list of queries
+    :return: {src: {netmask: {network: [query index]}}}"""
+    groups = collections.defaultdict(
+        lambda: collections.defaultdict(
+            lambda: collections.defaultdict(list)))
+    for i, q in enumerate(queries):
+        try:
+            src, _ = q.path_endpoints()
+        except AttributeError:
+            continue  # This is a confine query
+        groups[src][int(q.prefix.netmask)][
+            int(q.prefix.network_address)].append(i)
+    return groups
+
+
+def classify_packets(traffic_slices, queries):
+    """Select the packets of every MIRROR query in a single pass over the
+    packets mirrored at each source, i.e. one dict lookup per packet and per
+    distinct netmask instead of one prefix test per packet and per query.
+
+    :traffic_slices: the packets mirrored at every location
+    :queries: the list of queries
+    :return: {query index: [packets mirrored at its source, in order]}"""
+    selected = {}
+    for src, by_mask in _prefix_groups(queries).iteritems():
+        by_mask = [(mask, by_net,
+                    {net: [] for net in by_net})
+                   for mask, by_net in by_mask.iteritems()]
+        for pkt in traffic_slices.get(src, ()):
+            dst = _addr_to_int(pkt.dst)
+            for mask, _, pkts in by_mask:
+                try:
+                    pkts[dst & mask].append(pkt)
+                except KeyError:
+                    pass
+        for _, by_net, pkts in by_mask:
+            for net, idx in by_net.iteritems():
+                for i in idx:
+                    selected[i] = pkts[net]
+    return selected
+
+
+class SliceBuilder(object):
+    """Accumulate the packets mirrored during a slice in compact columns,
+    rather than keeping one Python object per packet."""
+
+    def __init__(self):
+        self.locations = {}  # location -> location id
+        self._loc = array.array('H')
+        self._dst = array.array('I')
+        self._ttl = array.array('B')
+        self._key = array.array('l')
+        self._ts = array.array('d')
+
+    def add(self, loc, pkt, ts=0):
+        """Register a packet mirrored at a location.
+
+        :loc: the location where the packet was mirrored
+        :pkt: the mirrored packet
+        :ts: its reception timestamp"""
+        try:
+            lid = self.locations[loc]
+        except KeyError:
+            lid = self.locations[loc] = len(self.locations)
+        self._loc.append(lid)
+        self._dst.append(_addr_to_int(pkt.dst))
+        self._ttl.append(pkt.ttl)
+        # The hash of the invariant fields (see the __eq__ overload)
+        self._key.append(hash(pkt))
+        self._ts.append(ts)
+
+    def build(self):
+        """:return: the ColumnarSlice holding all registered packets"""
+        return ColumnarSlice(self.locations,
+                             *(np.frombuffer(a, dtype=np.dtype(a.typecode))
+                               for a in (self._loc, self._dst, self._ttl,
+                                         self._key, self._ts)))
+
+
+class ColumnarSlice(object):
+    """The packets mirrored during a slice, stored as columns of a table
+    whose rows are packets in reception order."""
+
+    def __init__(self, locations, loc, dst, ttl, key, ts):
+        """:locations: a dict mapping every location to its location id
+        :loc: the id of the location where each packet was mirrored
+        :dst: the destination address of each packet, as uint32
+        :ttl: the TTL of each packet, as uint8
+        :key: the hash of the invariant fields of each packet
+        :ts: the reception timestamp of each packet"""
+        self.locations = locations
+        self.loc = loc
+        self.dst = dst
+        self.ttl = ttl
+        self.key = key
+        self.ts = ts
+        # Group the rows per location, preserving their order, and sort the
+        # keys of each group to join them with binary searches
+        order = np.argsort(loc, kind='mergesort')
+        bounds = np.searchsorted(loc[order], np.arange(len(locations) + 1))
+        self._rows = {}
+        self._sorted = {}
+        for lid in xrange(len(locations)):
+            rows = order[bounds[lid]:bounds[lid + 1]]
+            by_key = rows[np.argsort(key[rows], kind='mergesort')]
+            self._rows[lid] = rows
+            self._sorted[lid] = key[by_key], by_key
+
+    @classmethod
+    def from_slices(cls, traffic_slices):
+        """Convert per-location lists of packets to a ColumnarSlice."""
+        builder = SliceBuilder()
+        for loc, pkts in traffic_slices.iteritems():
+            for pkt in pkts:
+                builder.add(loc, pkt)
+        return builder.build()
+
+    def rows(self, loc):
+        """:return: the rows of the packets mirrored at loc"""
+        try:
+            return self._rows[self.locations[loc]]
+        except KeyError:
+            return np.empty(0, dtype=np.intp)
+
+    def find(self, loc, keys):
+        """Find the first copy mirrored at a location of a set of packets.
+
+        :loc: the location
+        :keys: an array of packet keys
+        :return: the row of each copy, or -1 if it was not seen at loc"""
+        try:
+            skeys, srows = self._sorted[self.locations[loc]]
+        except KeyError:
+            return np.full(len(keys), -1, dtype=np.intp)
+        if not len(skeys):
+            return np.full(len(keys), -1, dtype=np.intp)
+        pos = np.minimum(np.searchsorted(skeys, keys), len(skeys) - 1)
+        return np.where(skeys[pos] == keys, srows[pos], -1)
+
+
+def classify_rows(cslice, queries):
+    """Vectorized version of classify_packets over a ColumnarSlice, costing
+    one masked comparison of the source rows per distinct netmask.
+
+    :cslice: the ColumnarSlice to classify
+    :queries: the list of queries
+    :return: {query index: rows of the packets mirrored at its source}"""
+    selected = {}
+    for src, by_mask in _prefix_groups(queries).iteritems():
+        rows = cslice.rows(src)
+        dst = cslice.dst[rows]
+        for mask, by_net in by_mask.iteritems():
+            nets = np.array(sorted(by_net), dtype=np.uint32)
+            masked = dst & np.uint32(mask)
+            pos = np.minimum(np.searchsorted(nets, masked), len(nets) - 1)
+            hit = nets[pos] == masked
+            # Group the matching rows per network, preserving their order
+            pos = pos[hit]
+            order = np.argsort(pos, kind='mergesort')
+            hits = rows[hit][order]
+            bounds = np.searchsorted(pos[order], np.arange(len(nets) + 1))
+            for j, net in enumerate(nets):
+                for i in by_net[int(net)]:
+                    selected[i] = hits[bounds[j]:bounds[j + 1]]
+    return selected
+
+
+def ttl_decreases(cslice, prev_ttl, rows):
+    """Vectorized TTL decrease between two sets of copies.
+
+    :cslice: the ColumnarSlice holding the copies
+    :prev_ttl: the TTLs of the copies at the previous location
+    :rows: the rows of the copies at the next location
+    :return: the TTL decrease of each packet"""
+    return prev_ttl.astype(np.int16) - cslice.ttl[rows]
+
+
+def analyze_query_columnar(q, cslice, mismatches, selected=None):
+    """Vectorized version of analyze_query over a ColumnarSlice.
+
+    Packets are identified by the hash of their invariant fields, and the
+    exemplars of TTL mismatches are described by their destination and TTL.
+
+    :q: the query to analyze
+    :cslice: the ColumnarSlice to analyze
+    :mismatches: the TTLMismatches registering the TTL mismatches
+    :selected: the rows of the packets of the query (see classify_rows), if
+               already known
+    :return: a QueryStats instance, or None if q is not a MIRROR query"""
+    try:
+        src, dst = q.path_endpoints()
+    except AttributeError:
+        return None  # This is a confine query
+    if selected is None:
+        selected = cslice.rows(src)
+        selected = selected[prefix_mask(cslice.dst[selected], q.prefix)]
+    rows = selected
+    keys = cslice.key[rows]
+    prev_ttl = cslice.ttl[rows].astype(np.int16)
+    prev_loc = np.full(len(rows), cslice.locations.get(src, -1),
+                       dtype=np.intp)
+    loc_names = {lid: loc for loc, lid in cslice.locations.iteritems()}
+    at_dst = np.zeros(len(rows), dtype=bool)
+    others = set()
+    for loc, dist in q.locations:
+        if loc == src:
+            continue
+        others.add(loc)
+        lid = cslice.locations.get(loc)
+        if lid is None:
+            continue  # Nothing was mirrored at loc, all copies are missing
+        copies = cslice.find(loc, keys)
+        found = copies >= 0
+        decrease = ttl_decreases(cslice, prev_ttl[found], copies[found])
+        wrong = decrease != dist
+        if wrong.any():
+            # Aggregate the mismatches per previous location and decrease
+            pairs = np.stack((prev_loc[found][wrong], decrease[wrong]))
+            kinds, first, counts = np.unique(pairs, axis=1, return_index=True,
+                                             return_counts=True)
+            for (prev_lid, observed), row, count in itertools.izip(
+                    kinds.T, copies[found][wrong][first], counts):
+                mismatches.add(q, loc_names[prev_lid], loc, dist, observed,
+                               'dst=%s ttl=%d' % (
+                                   ipaddress.ip_address(int(cslice.dst[row])),
+                                   cslice.ttl[row]),
+                               count=int(count))
+        prev_ttl[found] = cslice.ttl[copies[found]]
+        prev_loc[found] = lid
+        if loc == dst:
+            at_dst = found
+    lost = np.count_nonzero(~at_dst)
+    # see follow_packet, every location but src is recorded in seen
+    load_balanced = (np.count_nonzero(at_dst)
+                     if len(others) + 1 < len(q.locations) else 0)
+    outcomes = [0, 0, 0]
+    outcomes[LOST] = lost
+    outcomes[LOAD_BALANCED] = load_balanced
+    return _query_stats(len(np.unique(keys)), outcomes)
+
+
+# The slice being analyzed, inherited by the workers when they are forked
+_SLICE = None
+
+
+def _analyze_shard(shard):
+    """Analyze a subset of the queries of _SLICE in a worker process.
+
+    :shard: the indices of the queries to analyze
+    :return: a list of (query index, QueryStats), and the TTLMismatches"""
+    queries, analyze, selected, exemplars = _SLICE
+    mismatches = TTLMismatches(exemplars=exemplars)
+    return [(i, analyze(queries[i], mismatches=mismatches,
+                        selected=selected.get(i)))
+            for i in shard], mismatches
+
+
+class Analyzer(MeasurementProcessor):
+    """
+    Compute loss rates and load-balancing occurences for all MIRROR queries.
+    """
+
+    def __init__(self, jobs=1, columnar=False, exemplars=3,
+                 mismatch_log=None):
+        """:jobs: the number of worker processes analyzing the queries of a
+                  slice in parallel, 1 to analyze them in this process
+        :columnar: convert the slices to a ColumnarSlice and analyze them
+                   with vectorized operations
+        :exemplars: the number of exemplars reported per TTL mismatch
+        :mismatch_log: the file where the TTL mismatches of every slice are
+                       appended as JSON lines"""
+        super(Analyzer, self).__init__()
+        self.jobs = max(1, jobs)
+        self.columnar = columnar
+        self.mismatches = TTLMismatches(exemplars=exemplars)
+        self.mismatch_log = mismatch_log
+
+    def process(self, locations, queries, traffic_slices):
+        queries = list(queries)
+        # Select the packets of every query at once
+        if self.columnar:
+            cslice = ColumnarSlice.from_slices(traffic_slices)
+            selected = classify_rows(cslice, queries)
+            analyze = functools.partial(analyze_query_columnar,
+                                        cslice=cslice)
+        else:
+            selected = classify_packets(traffic_slices, queries)
+            # Index every location once per slice, lookups are then O(1)
+            indexes = {loc: index_slice(pkts)
+                       for loc, pkts in traffic_slices.iteritems()}
+            analyze = functools.partial(analyze_query,
+                                        traffic_slices=traffic_slices,
+                                        indexes=indexes)
+        if self.jobs > 1 and len(queries) > 1:
+            stats = self._process_parallel(queries, analyze, selected)
+        else:
+            stats = [analyze(q, mismatches=self.mismatches,
+                             selected=selected.get(i))
+                     for i, q in enumerate(queries)]
+        for q, s in itertools.izip(queries, stats):
+            if s is None:
+                continue
             LOG.info('Statistics for %s on %s: entered=%d, exited=%d, lost=%d,'
-                     ' load-balanced=%d', q.name, q.subregions, len(matches),
-                     len(matches) - lost - load_balanced, lost, load_balanced)
+                     ' load-balanced=%d', q.name, q.subregions, s.entered,
+                     s.exited, s.lost, s.load_balanced)
+        if self.mismatch_log:
+            with open(self.mismatch_log, 'a') as sink:
+                self.mismatches.emit(sink)
+        else:
+            self.mismatches.emit()
 
+    def _process_parallel(self, queries, analyze, selected):
+        """Spread the queries across a pool of forked workers, which inherit
+        the slice instead of receiving a pickled copy of it."""
+        global _SLICE
+        jobs = min(self.jobs, len(queries))
+        # Interleave the queries to balance the shards
+        shards = [list(xrange(i, len(queries), jobs)) for i in xrange(jobs)]
+        stats = [None] * len(queries)
+        _SLICE = queries, analyze, selected, self.mismatches.exemplars
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for res, mismatches in pool.imap_unordered(_analyze_shard,
+                                                       shards):
+                for i, s in res:
+                    stats[i] = s
+                self.mismatches.merge(mismatches)
+            pool.close()
+        except Exception:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _SLICE = None
+        return stats
 
-def _complete_graph(db, net, collector_name):
-    g = net.graph
+
+def _extract_topology(db, collector_name):
+    """Extract the nodes and links from a topology db, walking the neighbours
+    of every node once.
+
+    :db: the content of the TopologyDB
+    :collector_name: the name of the collector node
+    :return: a dict listing the egresses, the routers, and the links as
+             (u, v, (u address, u interface), (v address, v interface))"""
+    topo = {'egresses': [], 'routers': [], 'links': []}
     # Register all routers/egresses
     for node, prop in db.iteritems():
         if prop.get('is_egress', False):
-            g.register_egress(node)
+            topo['egresses'].append(node)
         elif node != collector_name:
-            g.register_router(node)
-    # Brute-force to identify all links
-    for u, v in itertools.combinations(db.keys(), 2):
-        if v not in db[u]:
-            continue
-        base = db[u][v]
-        # Extract link properties
-        uv_prop = {g.ADDRESS_KEY: base['ip'].split('/')[0],
-                   g.IFNAME_KEY: base['name']}
-        base = db[v][u]
-        vu_prop = {g.ADDRESS_KEY: base['ip'].split('/')[0],
-                   g.IFNAME_KEY: base['name']}
-        g.register_link(u, v, uv_prop=uv_prop, vu_prop=vu_prop)
+            topo['routers'].append(node)
+    # Register every link once, from its endpoint listed first in the db
+    order = {node: i for i, node in enumerate(db)}
+    for u, prop in db.iteritems():
+        for v in prop:
+            if order.get(v, -1) <= order[u]:
+                continue  # Not a neighbour, or already registered
+            uv, vu = prop[v], db[v][u]
+            topo['links'].append((u, v,
+                                  (uv['ip'].split('/')[0], uv['name']),
+                                  (vu['ip'].split('/')[0], vu['name'])))
+    return topo
+
+
+def _load_topology(filename):
+    """Load a topology saved by _save_topology."""
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def _save_topology(topo, filename):
+    """Save a topology extracted by _extract_topology."""
+    with open(filename, 'w') as f:
+        json.dump(topo, f)
+
+
+def _complete_graph(topo, net):
+    g = net.graph
+    for node in topo['egresses']:
+        g.register_egress(node)
+    for node in topo['routers']:
+        g.register_router(node)
+    for u, v, (uv_addr, uv_name), (vu_addr, vu_name) in topo['links']:
+        g.register_link(u, v,
+                        uv_prop={g.ADDRESS_KEY: uv_addr,
+                                 g.IFNAME_KEY: uv_name},
+                        vu_prop={g.ADDRESS_KEY: vu_addr,
+                                 g.IFNAME_KEY: vu_name})
     net.update_router_addresses()
 
 
@@ -100,6 +797,24 @@ def _build_parser():
                         help='Requirements file name')
     parser.add_argument('--ssh-key', default=None, required=True,
                         help='SSH key to use to log into routers')
+    parser.add_argument('--jobs', default=1, type=int,
+                        help='Number of worker processes analyzing the '
+                        'queries of a slice')
+    parser.add_argument('--columnar', default=False, action='store_true',
+                        help='Store the slices in compact columns and '
+                        'analyze them with vectorized operations')
+    parser.add_argument('--exemplars', default=3, type=int,
+                        help='Number of exemplar packets reported per kind '
+                        'of TTL mismatch')
+    parser.add_argument('--mismatch-log', default=None,
+                        help='File where the TTL mismatches of every slice '
+                        'are appended as JSON lines')
+    parser.add_argument('--topology', default=None,
+                        help='Load the network graph from this snapshot '
+                        'rather than from the topology db')
+    parser.add_argument('--save-topology', default=None,
+                        help='Save a snapshot of the network graph to this '
+                        'file')
     return parser
 
 
@@ -112,10 +827,19 @@ def _main():
     db = TopologyDB(db=args.db)
     collector_itf = db._network[args.name]['interfaces'][0]
     collect_address = db._network[args.name][collector_itf]['ip'].split('/')[0]
-    c = Collector(measurement_processor=Analyzer(),
+    analyzer = Analyzer(jobs=args.jobs, columnar=args.columnar,
+                        exemplars=args.exemplars,
+                        mismatch_log=args.mismatch_log)
+    c = Collector(measurement_processor=analyzer,
                   ssh_keypath=args.ssh_key, ssh_username='root',
                   phys_dst=collect_address)
-    _complete_graph(db._network, c.net, args.name)
+    if args.topology:
+        topo = _load_topology(args.topology)
+    else:
+        topo = _extract_topology(db._network, args.name)
+    if args.save_topology:
+        _save_topology(topo, args.save_topology)
+    _complete_graph(topo, c.net)
     c.load_requirements(args.req)
     join()
 
@@ -1,13 +1,300 @@
 #!/bin/python2
 import argparse
+import array
+import ctypes
+import ctypes.util
+import logging
+import multiprocessing
+import signal
 import socket
 import random
+import sys
 import time
 import struct
 
 
+logging.basicConfig(level=logging.INFO)
+LOG = logging.getLogger(__name__)
+
 # Packet rate per flow
 PKT_SEC = 100
+# The source port of the first worker, the next ones use the following ports
+SRC_PORT = 12345
+# The maximal number of messages per sendmmsg call (UIO_MAXIOV)
+MAX_BATCH = 1024
+
+
+class TokenBucket(object):
+    """Pace events at a given rate, allowing short bursts to catch up when
+    the sender fell behind.
+
+    Tokens are scheduled at fixed times rather than accumulated after each
+    sleep, so that oversleeping does not lower the long-term rate."""
+
+    def __init__(self, rate, burst=1):
+        """:rate: the number of tokens per second
+        :burst: the maximal number of late tokens that can be taken back to
+                back"""
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self.next = time.time()
+
+    def take(self):
+        """Block until a token is available, and consume it."""
+        now = time.time()
+        # Do not accumulate more than burst late tokens
+        self.next = max(self.next, now - (self.burst - 1) * self.interval)
+        if self.next > now:
+            time.sleep(self.next - now)
+        self.next += self.interval
+
+
+class _Sender(object):
+    """Send a payload to every destination, one sendto at a time."""
+
+    def __init__(self, sfd, dests):
+        self.sfd = sfd
+        self.dests = dests
+
+    def send(self, payload):
+        """:return: the indices of the destinations that could not be sent
+                    the payload"""
+        failed = []
+        for i, dst in enumerate(self.dests):
+            try:
+                self.sfd.sendto(payload, 0, dst)
+            except (IOError, OSError, socket.error):
+                failed.append(i)
+        return failed
+
+
+class _SockaddrIn(ctypes.Structure):
+    _fields_ = [('sin_family', ctypes.c_ushort),
+                ('sin_port', ctypes.c_uint16),
+                ('sin_addr', ctypes.c_uint8 * 4),
+                ('sin_zero', ctypes.c_uint8 * 8)]
+
+
+class _Iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class _Msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_Iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _Mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _Msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+class _MMsgSender(object):
+    """Send a payload to every destination with batched sendmmsg calls.
+
+    The messages are built once, every packet points to the same payload
+    buffer, which is updated before each batch."""
+
+    def __init__(self, sfd, dests, payload_len):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._sendmmsg = libc.sendmmsg
+        self.sfd = sfd
+        self.payload = ctypes.create_string_buffer(payload_len)
+        self.iov = _Iovec(ctypes.cast(self.payload, ctypes.c_void_p),
+                          payload_len)
+        self.addrs = (_SockaddrIn * len(dests))()
+        self.msgs = (_Mmsghdr * len(dests))()
+        for addr, msg, (ip, port) in zip(self.addrs, self.msgs, dests):
+            addr.sin_family = socket.AF_INET
+            addr.sin_port = socket.htons(port)
+            addr.sin_addr[:] = bytearray(socket.inet_aton(ip))
+            msg.msg_hdr.msg_name = ctypes.addressof(addr)
+            msg.msg_hdr.msg_namelen = ctypes.sizeof(addr)
+            msg.msg_hdr.msg_iov = ctypes.pointer(self.iov)
+            msg.msg_hdr.msg_iovlen = 1
+
+    def send(self, payload):
+        """:return: the indices of the destinations that could not be sent
+                    the payload"""
+        ctypes.memmove(self.payload, payload, len(payload))
+        failed = []
+        pos = 0
+        while pos < len(self.msgs):
+            res = self._sendmmsg(
+                self.sfd.fileno(),
+                ctypes.byref(self.msgs, pos * ctypes.sizeof(_Mmsghdr)),
+                min(MAX_BATCH, len(self.msgs) - pos), 0)
+            if res > 0:
+                pos += res
+            else:
+                # Skip the failing message, as sendto would
+                failed.append(pos)
+                pos += 1
+        return failed
+
+
+def _mk_sender(sfd, dests, batch):
+    if batch:
+        try:
+            return _MMsgSender(sfd, dests, struct.calcsize('>Q'))
+        except (OSError, AttributeError) as e:
+            LOG.warning('sendmmsg is not available, falling back to '
+                        'sendto: %s', e)
+    return _Sender(sfd, dests)
+
+
+class SentLog(object):
+    """Record how many packets were sent to every flow, per interval.
+
+    The log is a binary file starting with the number of flows and their
+    destination ports, followed by one record per interval: its end
+    timestamp, the sequence numbers of its first and last flooding sessions,
+    and the number of packets sent to every flow. All values are in network
+    byte order."""
+
+    HEADER = struct.Struct('>I')
+    RECORD = struct.Struct('>dQQ')
+
+    def __init__(self, f, dests, interval):
+        """:f: the file where the log is written
+        :dests: the (address, port) of every flow
+        :interval: the duration (in seconds) of an interval"""
+        self.f = f
+        self.flows = len(dests)
+        self.interval = interval
+        self.first_sqc = None
+        self.last_sqc = None
+        self.sessions = 0
+        self.failures = {}  # flow index -> send failures
+        self.end = time.time() + interval
+        ports = array.array('H', (p for _, p in dests))
+        if sys.byteorder == 'little':
+            ports.byteswap()
+        f.write(self.HEADER.pack(self.flows))
+        f.write(ports.tostring())
+
+    def sent(self, sqc, failed):
+        """Register a flooding session.
+
+        :sqc: its sequence number
+        :failed: the indices of the flows whose packet could not be sent"""
+        if self.first_sqc is None:
+            self.first_sqc = sqc
+        self.last_sqc = sqc
+        self.sessions += 1
+        for i in failed:
+            self.failures[i] = self.failures.get(i, 0) + 1
+        if time.time() >= self.end:
+            self.flush()
+
+    def flush(self):
+        """Write the record of the current interval, and start a new one."""
+        now = time.time()
+        if self.sessions:
+            counts = array.array('I', [self.sessions]) * self.flows
+            for i, cnt in self.failures.iteritems():
+                counts[i] -= cnt
+            if sys.byteorder == 'little':
+                counts.byteswap()
+            self.f.write(self.RECORD.pack(now, self.first_sqc,
+                                          self.last_sqc))
+            self.f.write(counts.tostring())
+            self.f.flush()
+        self.first_sqc = self.last_sqc = None
+        self.sessions = 0
+        self.failures.clear()
+        self.end = now + self.interval
+
+
+def read_sent_log(filename):
+    """Read a log written by SentLog.
+
+    :filename: the log file name
+    :return: the list of flow ports, and the list of records as
+             (end timestamp, first sequence number, last sequence number,
+              {port: packets sent})"""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    flows, = SentLog.HEADER.unpack_from(data)
+    pos = SentLog.HEADER.size
+    ports = array.array('H', data[pos:pos + 2 * flows])
+    pos += 2 * flows
+    if sys.byteorder == 'little':
+        ports.byteswap()
+    records = []
+    while pos < len(data):
+        ts, first, last = SentLog.RECORD.unpack_from(data, pos)
+        pos += SentLog.RECORD.size
+        counts = array.array('I', data[pos:pos + 4 * flows])
+        pos += 4 * flows
+        if sys.byteorder == 'little':
+            counts.byteswap()
+        records.append((ts, first, last, dict(zip(ports, counts))))
+    return list(ports), records
+
+
+def _exit(*_):
+    sys.exit(0)
+
+
+def _flood(sfd, dests, args, log=None):
+    """Flood the destinations at the target rate until terminated.
+
+    Every flooding session sends one packet to every flow, whose payload is
+    the sequence number of the session, and thus a per-flow sequence
+    number.
+
+    :sfd: the socket to send from
+    :dests: the (address, port) of every flow
+    :args: the parsed command line arguments
+    :log: a SentLog recording the packets sent to every flow"""
+    sender = _mk_sender(sfd, dests, args.batch)
+    bucket = TokenBucket(args.rate, burst=args.burst)
+    sqc = 0
+    sent = 0
+    start = last_report = time.time()
+    try:
+        while True:
+            # wait until the next flooding session
+            bucket.take()
+            # same payload across flows, flood the dest
+            failed = sender.send(struct.pack('>Q', sqc))
+            sent += len(dests) - len(failed)
+            if log:
+                log.sent(sqc, failed)
+            sqc += 1
+            now = time.time()
+            if now - last_report >= args.report_interval:
+                elapsed = now - start
+                LOG.info('Sent %d packets to %d flows in %.2fs: %.1f pkt/s '
+                         'per flow (target: %.1f)', sent, len(dests),
+                         elapsed, sent / elapsed / len(dests), args.rate)
+                last_report = now
+    finally:
+        if log:
+            log.flush()
+
+
+def _worker(args, idx, dests):
+    """Flood a shard of the flows from its own socket.
+
+    :args: the parsed command line arguments
+    :idx: the index of the worker
+    :dests: the (address, port) of the flows of the worker"""
+    signal.signal(signal.SIGTERM, _exit)
+    sfd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sfd.bind((args.origin, SRC_PORT + idx))
+    if not args.sent_log:
+        _flood(sfd, dests, args)
+        return
+    with open('%s.%d' % (args.sent_log, idx), 'wb') as f:
+        _flood(sfd, dests, args, SentLog(f, dests, args.log_interval))
 
 
 def _build_parser():
@@ -18,6 +305,26 @@ def _build_parser():
                         help='The source address to use')
     parser.add_argument('--count', default=None, required=True,
                         help='The number of flows to spawn')
+    parser.add_argument('--rate', default=PKT_SEC, type=float,
+                        help='The packet rate per flow')
+    parser.add_argument('--burst', default=1, type=int,
+                        help='The number of late flooding sessions that can '
+                        'be sent back to back to catch up with the rate')
+    parser.add_argument('--batch', default=False, action='store_true',
+                        help='Send the packets with batched sendmmsg calls')
+    parser.add_argument('--report-interval', default=10, type=float,
+                        help='The interval (in seconds) between two reports '
+                        'of the achieved rate')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='The number of processes across which the flows '
+                        'are spread, worker i sends from port %d + i' %
+                        SRC_PORT)
+    parser.add_argument('--sent-log', default=None,
+                        help='Log the packets sent to every flow in '
+                        'SENT_LOG.<worker index>')
+    parser.add_argument('--log-interval', default=1, type=float,
+                        help='The interval (in seconds) covered by each '
+                        'record of the sent log')
     return parser
 
 
@@ -27,25 +334,23 @@ def _parse_args(parser):
 
 def _main():
     args = _parse_args(_build_parser())
-    sfd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sfd.bind((args.origin, 12345))
     # pick dst ports
     dests = [(args.dst, p)
              for p in random.sample(list(xrange(1025, 65535)), int(args.count))]
-    dst = args.dst
-    sqc = 0
-    while True:
-        # same payload across flows
-        payload = struct.pack('>Q', sqc)
-        # flood the dest
-        for dst in dests:
-            try:
-                sfd.sendto(payload, 0, dst)
-            except (IOError, OSError, socket.error):
-                pass
-        sqc += 1
-        # wait until the next flooding session
-        time.sleep(1 / PKT_SEC)
+    workers = max(1, min(args.workers, len(dests)))
+    if workers == 1:
+        _worker(args, 0, dests)
+        return
+    # Terminate the workers along with this process
+    signal.signal(signal.SIGTERM, _exit)
+    procs = [multiprocessing.Process(target=_worker,
+                                     args=(args, i, dests[i::workers]))
+             for i in xrange(workers)]
+    for p in procs:
+        p.daemon = True
+        p.start()
+    for p in procs:
+        p.join()
 
 
 if __name__ == '__main__':
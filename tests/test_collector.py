@@ -0,0 +1,212 @@
+"""
+Check that the analyses of the collector agree with each other.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+import imp
+import ipaddress
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+COLLECTOR = os.path.join(os.path.dirname(__file__), os.pardir, 'labs',
+                         'paper-graph', 'collector.py')
+collector = imp.load_source('collector', COLLECTOR)
+logging.disable(logging.WARNING)
+
+
+class Packet(object):
+    """A mirrored packet, whose copies are equal whatever their TTL"""
+
+    def __init__(self, ident, dst, ttl):
+        self.ident = ident
+        self.dst = ipaddress.ip_address(dst)
+        self.ttl = ttl
+
+    def __eq__(self, other):
+        return self.ident == other.ident
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.ident)
+
+    def __str__(self):
+        return 'P%d' % self.ident
+
+
+class MirrorQuery(object):
+    """A MIRROR query over a path, expecting a TTL decrease of one per hop"""
+
+    def __init__(self, name, path, prefix):
+        self.name = name
+        self.subregions = path
+        self.locations = [(loc, i and 1) for i, loc in enumerate(path)]
+        self.prefix = ipaddress.ip_network(prefix, strict=False)
+
+    def path_endpoints(self):
+        return self.locations[0][0], self.locations[-1][0]
+
+
+def random_slice(seed, count=2000, locations='ABCDE'):
+    """Mirror packets along the locations, some of them being lost, seen
+    with an unexpected TTL, or duplicated
+    :return: the packets mirrored at every location, and random queries
+             over these locations and over one that mirrored nothing"""
+    rnd = random.Random(seed)
+    slices = {loc: [] for loc in locations + 'Z'}
+    for ident in xrange(count):
+        dst = u'10.0.%d.1' % rnd.randrange(10)
+        for hop, loc in enumerate(locations):
+            if rnd.random() < .9:
+                skew = 1 if rnd.random() < .02 else 0
+                slices[loc].append(Packet(ident, dst, 64 - hop - skew))
+            if rnd.random() < .02:
+                slices[loc].append(Packet(ident, dst, 64 - hop))
+    queries = []
+    for i in xrange(20):
+        path = rnd.sample(locations + 'Z', rnd.randint(2, 4))
+        prefix = u'10.0.%d.0/%d' % (rnd.randrange(10), rnd.choice((20, 24)))
+        queries.append(MirrorQuery('q%d' % i, path, prefix))
+    return slices, queries
+
+
+def batch(q, slices, indexes):
+    """:return: the stats and mismatch counts of analyze_query"""
+    mismatches = collector.TTLMismatches()
+    stats = collector.analyze_query(q, slices, indexes, mismatches)
+    return stats, dict(mismatches.counts)
+
+
+def columnar(q, cslice):
+    """:return: the stats and mismatch counts of analyze_query_columnar"""
+    mismatches = collector.TTLMismatches()
+    stats = collector.analyze_query_columnar(q, cslice, mismatches)
+    return stats, dict(mismatches.counts)
+
+
+def analyses(slices):
+    """:return: functions analyzing a query over the slices with
+                analyze_query, and with analyze_query_columnar"""
+    indexes = {loc: collector.index_slice(pkts)
+               for loc, pkts in slices.iteritems()}
+    cslice = collector.ColumnarSlice.from_slices(slices)
+    return (lambda q: batch(q, slices, indexes),
+            lambda q: columnar(q, cslice))
+
+
+class TestColumnarMismatches(unittest.TestCase):
+
+    def test_consecutive_mismatches(self):
+        # Both hops are wrong, each must be charged to its own pair
+        q = MirrorQuery('q', 'ABC', u'10.0.0.0/8')
+        slices = {'A': [Packet(1, u'10.0.0.1', 64)],
+                  'B': [Packet(1, u'10.0.0.1', 60)],
+                  'C': [Packet(1, u'10.0.0.1', 55)]}
+        expected = {('q', 'A', 'B', 1, 4): 1, ('q', 'B', 'C', 1, 5): 1}
+        for analyze in analyses(slices):
+            self.assertEqual(analyze(q)[1], expected)
+
+    def test_random_slices(self):
+        for seed in xrange(10):
+            slices, queries = random_slice(seed)
+            by_batch, by_columnar = analyses(slices)
+            for q in queries:
+                self.assertEqual(by_columnar(q), by_batch(q),
+                                 'seed %d, %s over %s' % (seed, q.name,
+                                                          q.subregions))
+
+
+class TestColumnarAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_classify(self):
+        slices, queries = random_slice(0)
+        cslice = collector.ColumnarSlice.from_slices(slices)
+        by_rows = collector.classify_rows(cslice, queries)
+        by_packets = collector.classify_packets(slices, queries)
+        self.assertEqual(sorted(by_rows), sorted(by_packets))
+        for i, pkts in by_packets.iteritems():
+            rows = by_rows[i]
+            self.assertEqual(list(cslice.key[rows]), [hash(p) for p in pkts])
+            self.assertEqual(list(cslice.ttl[rows]), [p.ttl for p in pkts])
+
+    def test_empty_slice(self):
+        q = MirrorQuery('q', 'ABC', u'10.0.0.0/8')
+        slices = {'A': [], 'B': [], 'C': []}
+        for analyze in analyses(slices):
+            self.assertEqual(analyze(q), (collector.QueryStats(0, 0, 0, 0),
+                                          {}))
+
+    def test_analyzer(self):
+        # Every mode of the Analyzer reports the same TTL mismatches
+        slices, queries = random_slice(1)
+        reports = []
+        for i, (jobs, columnar) in enumerate(((1, False), (1, True),
+                                              (2, False), (2, True))):
+            log = os.path.join(self.tmp, '%d.jsonl' % i)
+            analyzer = collector.Analyzer(jobs=jobs, columnar=columnar,
+                                          mismatch_log=log)
+            analyzer.process(None, queries, slices)
+            with open(log, 'r') as f:
+                reports.append(sorted(
+                    (r['query'], r['from'], r['to'], r['expected'],
+                     r['observed'], r['count'])
+                    for r in (json.loads(line) for line in f)))
+        self.assertTrue(reports[0])
+        for report in reports[1:]:
+            self.assertEqual(report, reports[0])
+
+
+class TestIncrementalAnalyzer(unittest.TestCase):
+
+    def test_random_streams(self):
+        for seed in xrange(5):
+            slices, queries = random_slice(seed)
+            by_batch, _ = analyses(slices)
+            expected = [(q, by_batch(q)[0]) for q in queries]
+            stream = [(loc, pkt) for loc, pkts in sorted(slices.iteritems())
+                      for pkt in pkts]
+            # Whatever the reception order, with windows large enough
+            random.Random(seed).shuffle(stream)
+            analyzer = collector.IncrementalAnalyzer(
+                queries, timeout=float('inf'), max_pending=len(stream),
+                max_resolved=len(stream))
+            for ts, (loc, pkt) in enumerate(stream):
+                analyzer.add(loc, pkt, ts)
+            self.assertEqual(analyzer.close(), expected, 'seed %d' % seed)
+            # In packet order, small windows suffice
+            stream.sort(key=lambda (loc, pkt): pkt.ident)
+            analyzer = collector.IncrementalAnalyzer(
+                queries, timeout=float('inf'), max_pending=50,
+                max_resolved=50)
+            for ts, (loc, pkt) in enumerate(stream):
+                analyzer.add(loc, pkt, ts)
+            self.assertEqual(analyzer.close(), expected, 'seed %d' % seed)
+
+    def test_idle_query(self):
+        # The losses of a query are reported while the others receive
+        # packets
+        idle = MirrorQuery('idle', 'AB', u'10.0.0.0/24')
+        busy = MirrorQuery('busy', 'CD', u'10.0.1.0/24')
+        analyzer = collector.IncrementalAnalyzer([idle, busy], timeout=1.)
+        analyzer.add('A', Packet(0, u'10.0.0.1', 64), 0.)
+        for i in xrange(1, 30):
+            analyzer.add('C', Packet(i, u'10.0.1.1', 64), i * .1)
+            analyzer.add('D', Packet(i, u'10.0.1.1', 63), i * .1)
+        self.assertEqual(analyzer.stats()[0],
+                         (idle, collector.QueryStats(1, 0, 1, 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Check that the sweeps of the benchmarks do not depend on how they are run:
+sequentially or by worker processes, and with paths generated inline or
+replayed from a workload file.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+import contextlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from benchmarks import (bench_confinement, bench_keypoints, gen_workload,
+                        timing)
+from benchmarks.runner import run_sweep
+
+logging.disable(logging.INFO)
+
+# Small sweeps, the algorithms being called once per path
+ARGS = ['-z', 'Abilene', 'Aarnet', '-r', '--repeat', '2', '--max-path', '3',
+        '--no-graph-cache', '--warmup', '0', '--samples', '1',
+        '--min-duration', '0']
+
+
+class Rows(object):
+    """Keep the rows written by a sweep, as a csv.DictWriter"""
+
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+
+@contextlib.contextmanager
+def command_line(module, argv):
+    """Give the small sweep arguments and argv to module in the block"""
+    saved = sys.argv
+    sys.argv = [module.__name__] + ARGS + list(argv)
+    try:
+        yield
+    finally:
+        sys.argv = saved
+        # parse_commandline only disables the DEBUG logs
+        logging.disable(logging.INFO)
+
+
+def sweep(module, *argv):
+    """Run the sweep of a benchmark
+    :return: its rows, without the measures"""
+    with command_line(module, argv):
+        args, graphs = module.parse_args()
+    rows = Rows()
+    run_sweep(graphs, module.run, rows, args)
+    measures = set(['time'] + timing.fields())
+    return [{k: v for k, v in row.iteritems() if k not in measures}
+            for row in rows.rows]
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_parallel(self):
+        for module in (bench_keypoints, bench_confinement):
+            rows = sweep(module)
+            self.assertTrue(rows)
+            self.assertEqual(sweep(module, '--jobs', '3'), rows)
+
+    def test_workload(self):
+        for module, selection in ((bench_keypoints, 'perturb'),
+                                  (bench_confinement, 'region')):
+            workload = os.path.join(self.tmp, '%s.wl' % selection)
+            argv = ['--path-selection', selection]
+            with command_line(gen_workload, argv + ['--out', workload]):
+                gen_workload.main()
+            rows = sweep(module, *argv)
+            self.assertTrue(rows)
+            self.assertEqual(sweep(module, '--workload', workload), rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
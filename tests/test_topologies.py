@@ -0,0 +1,63 @@
+"""
+Check that the compact shortest path store is a drop-in replacement for
+NetGraph.build_spt.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+import logging
+import random
+import unittest
+
+import numpy as np
+
+from benchmarks.topologies import topozoo
+from benchmarks.topologies.features import TopologyFeatures
+from benchmarks.topologies.spt import (CompactSPT, distance_matrix,
+                                       spt_distance_matrix)
+
+logging.disable(logging.INFO)
+
+TOPOLOGIES = ['Abilene', 'Aarnet', 'Agis', 'Geant2012']
+
+
+def build(name, compact_spt):
+    """:return: the sanitized graph of a topology zoo topology"""
+    random.seed(name)
+    return topozoo.get_topo(name, compact_spt=compact_spt)
+
+
+class TestCompactSPT(unittest.TestCase):
+
+    def test_same_paths(self):
+        for name in TOPOLOGIES:
+            full, compact = build(name, False), build(name, True)
+            self.assertIsInstance(compact.spt, CompactSPT)
+            self.assertEqual(full.egresses, compact.egresses)
+            for src in full:
+                for dst in full:
+                    self.assertEqual(sorted(full.spt[src][dst]),
+                                     sorted(compact.spt[src][dst]),
+                                     '%s: %s -> %s' % (name, src, dst))
+
+    def test_same_distances(self):
+        for name in TOPOLOGIES:
+            g = build(name, False)
+            nodes = g.nodes()
+            dist = distance_matrix(g, nodes)
+            self.assertTrue(np.array_equal(spt_distance_matrix(g, nodes),
+                                           dist), name)
+            self.assertTrue(np.array_equal(CompactSPT(g).dist, dist), name)
+
+    def test_same_features(self):
+        for name in TOPOLOGIES:
+            full, compact = build(name, False), build(name, True)
+            self.assertEqual(full.features.summary(),
+                             compact.features.summary(), name)
+            # Whether the distances are derived from the paths or not
+            full.spt = None
+            self.assertEqual(TopologyFeatures(full).summary(),
+                             compact.features.summary(), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
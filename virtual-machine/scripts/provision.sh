@@ -36,6 +36,8 @@ git clone https://github.com/mininet/mininet.git
 ./mininet/util/install.sh -n
 progress "Installing IPMininet"
 pip install ipmininet
+progress "Installing the lab dependencies"
+pip install numpy
 
 clone collector "the collector"
 clone experiments "the experiments"